@@ -52,10 +52,14 @@ class CashOrderAdmin(admin.ModelAdmin):
     list_display = ('unique_id', 'customer_name', 'sale_by', 'total_amount', 'total_profit')
     search_fields = ('id', 'unique_id')
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.calculate_total_values()
+
 
 @admin.register(SellerProfile)
 class SellerProfileAdmin(admin.ModelAdmin):
-    list_display = ('username', 'profit', 'seller_share', 'business_share')
+    list_display = ('username', 'running_profit', 'seller_share', 'business_share')
 
 
 @admin.register(ReturnCashOrder)
@@ -65,7 +69,18 @@ class ReturnCashOrderAdmin(admin.ModelAdmin):
 
 @admin.register(CompanyProfile)
 class CompanyProfileAdmin(admin.ModelAdmin):
-    list_display = ['owner_name', 'owner_balance', 'business_balance']
+    list_display = ['owner_name', 'running_owner_balance', 'running_business_balance']
+
+
+class SellerClosureInline(admin.TabularInline):
+    model = SellerClosure
+    extra = 0
+
+
+@admin.register(WeekClosure)
+class WeekClosureAdmin(admin.ModelAdmin):
+    inlines = [SellerClosureInline]
+    list_display = ['created_at', 'total_profit', 'business_profit']
 
 
 @admin.register(Transaction)
@@ -73,8 +88,13 @@ class TransactionAdmin(admin.ModelAdmin):
     list_display = ['order', 'seller', 'total_profit', 'seller_profit', 'owner_profit', 'business_profit']
 
 
+@admin.register(BalanceEntry)
+class BalanceEntryAdmin(admin.ModelAdmin):
+    list_display = ['created_at', 'account', 'seller', 'amount', 'description', 'compacted']
+    list_filter = ['account', 'compacted']
+
+
 admin.site.register(IMEINumber)
 admin.site.register(Product)
 admin.site.register(Vendor)
-admin.site.register(WeekClosure)
 # admin.site.register(CashOrderItem)
@@ -0,0 +1,140 @@
+import hashlib
+import time
+from django.core.cache import cache
+
+STOCK_GENERATION_KEY = "inventory:stock-generation"
+
+
+def stock_generation():
+    """
+    Returns the current stock generation. Every stock movement bumps it, which retires all
+    cached availability at once. A missing counter restarts from the clock so that keys
+    built before an eviction are never reused.
+    """
+    generation = cache.get(STOCK_GENERATION_KEY)
+    if generation is None:
+        cache.add(STOCK_GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = cache.get(STOCK_GENERATION_KEY)
+    return generation
+
+
+def bump_stock_generation():
+    try:
+        cache.incr(STOCK_GENERATION_KEY)
+    except ValueError:
+        stock_generation()
+
+
+def available_imeis_key(product_id):
+    return "inventory:available-imeis:{}:{}".format(product_id, stock_generation())
+
+
+SOLD_IMEIS_GENERATION_KEY = "inventory:sold-imeis-generation"
+SOLD_IMEIS_BITS = 2 ** 21
+SOLD_IMEIS_HASHES = 7
+
+_sold_imeis_mirror = {'generation': None, 'bits': None}
+
+
+def _bit_positions(number):
+    digest = hashlib.blake2b(str(number).encode(), digest_size=16).digest()
+    first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+    return [(first + i * second) % SOLD_IMEIS_BITS for i in range(SOLD_IMEIS_HASHES)]
+
+
+def _set_bits(bits, numbers):
+    for number in numbers:
+        for position in _bit_positions(number):
+            bits[position >> 3] |= 1 << (position & 7)
+
+
+def _sold_imeis_key(generation):
+    return "inventory:sold-imeis:{}".format(generation)
+
+
+def _sold_imeis_generation():
+    generation = cache.get(SOLD_IMEIS_GENERATION_KEY)
+    if generation is None:
+        cache.add(SOLD_IMEIS_GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = cache.get(SOLD_IMEIS_GENERATION_KEY)
+    return generation
+
+
+def _sold_imeis_filter():
+    """
+    Returns the Bloom filter bits of every IMEI that appears on a sale, as of the current generation.
+    The per-worker mirror is reused while the generation is unchanged, otherwise the shared copy is
+    fetched, or rebuilt from the database when no sale could derive it.
+    """
+    generation = _sold_imeis_generation()
+    if generation != _sold_imeis_mirror['generation']:
+        bits = cache.get(_sold_imeis_key(generation))
+        if bits is None:
+            from .models import CashOrderItem
+
+            bits = bytearray(SOLD_IMEIS_BITS // 8)
+            _set_bits(bits, CashOrderItem.objects.values_list('imei_or_serial_number', flat=True).distinct())
+            cache.add(_sold_imeis_key(generation), bytes(bits), timeout=None)
+        _sold_imeis_mirror.update(generation=generation, bits=bytes(bits))
+    return _sold_imeis_mirror['bits']
+
+
+def might_be_sold(number):
+    """ False only when the IMEI has certainly never been sold; True means the database must decide. """
+    bits = _sold_imeis_filter()
+    return all(bits[position >> 3] & (1 << (position & 7)) for position in _bit_positions(number))
+
+
+def add_sold_imeis(numbers):
+    """
+    Moves the filter to a new generation that includes the numbers. Each generation is derived only
+    from its direct predecessor, so concurrent sales never drop each other's IMEIs: when the
+    predecessor is not in the cache yet, the new generation is left to be rebuilt from the database.
+    """
+    try:
+        generation = cache.incr(SOLD_IMEIS_GENERATION_KEY)
+    except ValueError:
+        return
+    previous = cache.get(_sold_imeis_key(generation - 1))
+    if previous is not None:
+        bits = bytearray(previous)
+        _set_bits(bits, numbers)
+        cache.add(_sold_imeis_key(generation), bytes(bits), timeout=None)
+
+
+def retire_sold_imeis():
+    """ Starts a generation that is rebuilt from the database, dropping IMEIs whose sale was deleted. """
+    try:
+        cache.incr(SOLD_IMEIS_GENERATION_KEY)
+    except ValueError:
+        pass
+
+
+_singletons = {}
+
+
+def _singleton_version_key(model):
+    return "inventory:singleton:{}".format(model._meta.label_lower)
+
+
+def get_singleton(model):
+    """
+    Returns the first row of a single-row model such as Setting or CompanyProfile from worker memory,
+    reloading it only when another worker has bumped its version. The instance is shared, treat it
+    as read-only.
+    """
+    key = _singleton_version_key(model)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    if key not in _singletons or _singletons[key][0] != version:
+        _singletons[key] = (version, model.objects.order_by('id').first())
+    return _singletons[key][1]
+
+
+def bump_singleton(model):
+    try:
+        cache.incr(_singleton_version_key(model))
+    except ValueError:
+        pass
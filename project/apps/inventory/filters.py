@@ -0,0 +1,123 @@
+import datetime
+import operator
+import re
+from functools import reduce
+
+import django_filters
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.filters import SearchFilter
+
+from .models import CashOrder, Claim, Credit, ProductStockIn, ReturnCashOrder
+
+IMEI_RE = re.compile(r'\d{15}')
+CODE_RE = re.compile(r'[A-Z0-9]{6}')
+DATE_RE = re.compile(r'(\d{4})-(\d{2})(?:-(\d{2}))?')
+
+
+class RoutedSearchFilter(SearchFilter):
+    """
+    Provides search that classifies each term before choosing its lookups, so exact-looking terms
+    hit an index instead of an icontains scan. The view maps term kinds to lookups in search_routes:
+
+        imei    15 digits, exact lookups
+        code    6 letters or digits, as printed for a unique_id; matched upper-cased
+        number  other digits, exact lookups
+        date    YYYY-MM-DD or YYYY-MM, fields matched on that day or month
+        text    anything else, and any kind the view does not route; views must route it
+
+    Views without search_routes fall back to the plain search_fields behaviour.
+    """
+
+    def classify(self, term):
+        if IMEI_RE.fullmatch(term):
+            return 'imei'
+        if DATE_RE.fullmatch(term) and self.date_range(term):
+            return 'date'
+        if term.isdigit():
+            return 'number'
+        if CODE_RE.fullmatch(term.upper()):
+            return 'code'
+        return 'text'
+
+    def date_range(self, term):
+        year, month, day = DATE_RE.fullmatch(term).groups()
+        try:
+            start = datetime.date(int(year), int(month), int(day or 1))
+        except ValueError:
+            return None
+        if day:
+            end = start + datetime.timedelta(days=1)
+        else:
+            end = (start + datetime.timedelta(days=32)).replace(day=1)
+        return [timezone.make_aware(datetime.datetime.combine(date, datetime.time.min)) for date in (start, end)]
+
+    def term_condition(self, kind, lookups, term):
+        if kind == 'date':
+            start, end = self.date_range(term)
+            conditions = [Q(**{lookup + '__gte': start, lookup + '__lt': end}) for lookup in lookups]
+        else:
+            if kind == 'code':
+                term = term.upper()
+            conditions = [Q(**{lookup: term}) for lookup in lookups]
+        return reduce(operator.or_, conditions)
+
+    def filter_queryset(self, request, queryset, view):
+        routes = getattr(view, 'search_routes', None)
+        search_terms = self.get_search_terms(request)
+        if not routes or not search_terms:
+            return super().filter_queryset(request, queryset, view)
+
+        lookups = []
+        for term in search_terms:
+            kind = self.classify(term)
+            if kind not in routes:
+                kind = 'text'
+            lookups += routes[kind]
+            queryset = queryset.filter(self.term_condition(kind, routes[kind], term))
+        if self.must_call_distinct(queryset, lookups):
+            queryset = queryset.distinct()
+        return queryset
+
+
+class CashOrderFilter(django_filters.FilterSet):
+    """ Provides ?created_after/created_before, ?updated_after/updated_before, seller and code filters. """
+    created = django_filters.DateFromToRangeFilter(field_name='created_at')
+    updated = django_filters.DateFromToRangeFilter(field_name='updated_at')
+
+    class Meta:
+        model = CashOrder
+        fields = ['sale_by', 'unique_id']
+
+
+class ReturnCashOrderFilter(django_filters.FilterSet):
+    created = django_filters.DateFromToRangeFilter(field_name='created_at')
+    seller = django_filters.NumberFilter(field_name='cash_order__sale_by')
+
+    class Meta:
+        model = ReturnCashOrder
+        fields = ['reason', 'cash_order']
+
+
+class CreditFilter(django_filters.FilterSet):
+    created = django_filters.DateFromToRangeFilter(field_name='created_at')
+
+    class Meta:
+        model = Credit
+        fields = ['payment_status']
+
+
+class ClaimFilter(django_filters.FilterSet):
+    created = django_filters.DateFromToRangeFilter(field_name='created_at')
+
+    class Meta:
+        model = Claim
+        fields = ['status', 'product_stock', 'imei_or_serial_number']
+
+
+class ProductStockInFilter(django_filters.FilterSet):
+    created = django_filters.DateFromToRangeFilter(field_name='created_at')
+
+    class Meta:
+        model = ProductStockIn
+        fields = ['product', 'vendor']
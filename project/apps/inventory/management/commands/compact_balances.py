@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from project.apps.inventory.models import BalanceEntry
+
+
+class Command(BaseCommand):
+    help = "Folds pending balance ledger entries into the seller and company balances"
+
+    def handle(self, *args, **options):
+        compacted = BalanceEntry.objects.compact()
+        self.stdout.write("Compacted {} balance entries".format(compacted))
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:35
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def attach_imei_numbers(apps, schema_editor):
+    # IMEIs attached to more than one lot are left unset so that sales reject them
+    IMEINumber = apps.get_model('inventory', 'IMEINumber')
+    ProductStockIn = apps.get_model('inventory', 'ProductStockIn')
+    through = ProductStockIn.imei_or_serial_number.through
+
+    single_lot = through.objects.values('imeinumber').annotate(lots=Count('productstockin')).filter(lots=1)
+    IMEINumber.objects.filter(number__in=single_lot.values('imeinumber')).update(
+        product_stock=Subquery(through.objects.filter(imeinumber=OuterRef('pk')).values('productstockin')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0047_auto_20220826_0155'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imeinumber',
+            name='product_stock',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='imei_numbers', to='inventory.productstockin'),
+        ),
+        migrations.RunPython(attach_imei_numbers, migrations.RunPython.noop),
+    ]
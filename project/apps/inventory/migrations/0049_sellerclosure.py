@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0048_imeinumber_product_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weekclosure',
+            name='closing_business_balance',
+            field=models.IntegerField(default=0, help_text='Running business balance at closure'),
+        ),
+        migrations.AlterField(
+            model_name='companyprofile',
+            name='business_balance',
+            field=models.IntegerField(default=0, help_text='Running total, the balance is counted from the last closure'),
+        ),
+        migrations.AlterField(
+            model_name='sellerprofile',
+            name='profit',
+            field=models.IntegerField(default=0, help_text='Running total, the balance is counted from the last closure'),
+        ),
+        migrations.CreateModel(
+            name='SellerClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profit', models.IntegerField(help_text='Profit earned during the closed week')),
+                ('closing_profit', models.IntegerField(help_text='Running seller profit at closure')),
+                ('business_share', models.PositiveIntegerField()),
+                ('seller_share', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.sellerprofile')),
+                ('week_closure', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sellers', to='inventory.weekclosure')),
+            ],
+            options={
+                'unique_together': {('seller', 'week_closure')},
+            },
+        ),
+    ]
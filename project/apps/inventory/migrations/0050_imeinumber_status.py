@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:47
+
+from django.db import migrations, models
+
+
+def derive_imei_status(apps, schema_editor):
+    # later steps win, in the same precedence the status lookups used before this column existed
+    IMEINumber = apps.get_model('inventory', 'IMEINumber')
+    CashOrderItem = apps.get_model('inventory', 'CashOrderItem')
+    CreditItem = apps.get_model('inventory', 'CreditItem')
+    Claim = apps.get_model('inventory', 'Claim')
+
+    steps = [
+        ("RETURNED", CashOrderItem.objects.filter(cash_order__returncashorder__isnull=False)),
+        ("ON_CLAIM", Claim.objects.filter(status="PENDING")),
+        ("ON_CREDIT", CreditItem.objects.filter(credit__payment_status="PENDING")),
+        ("SOLD", CreditItem.objects.filter(credit__payment_status="CLEARED")),
+        ("SOLD", CashOrderItem.objects.filter(cash_order__returncashorder__isnull=True)),
+    ]
+    for status, items in steps:
+        IMEINumber.objects.filter(number__in=items.values('imei_or_serial_number')).update(status=status)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0049_sellerclosure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imeinumber',
+            name='status',
+            field=models.CharField(choices=[('IN_STOCK', 'In Stock'), ('SOLD', 'Sold'), ('ON_CREDIT', 'On Credit'), ('ON_CLAIM', 'On Claim'), ('RETURNED', 'Returned')], db_index=True, default='IN_STOCK', editable=False, max_length=20),
+        ),
+        migrations.RunPython(derive_imei_status, migrations.RunPython.noop),
+    ]
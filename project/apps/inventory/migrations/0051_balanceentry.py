@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0050_imeinumber_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='companyprofile',
+            name='business_balance',
+            field=models.IntegerField(default=0, help_text='Compacted running total, the balance is counted from the last closure'),
+        ),
+        migrations.AlterField(
+            model_name='companyprofile',
+            name='owner_balance',
+            field=models.IntegerField(default=0, help_text='Compacted total, pending ledger entries are added on read'),
+        ),
+        migrations.AlterField(
+            model_name='sellerprofile',
+            name='profit',
+            field=models.IntegerField(default=0, help_text='Compacted running total, pending ledger entries are added on read'),
+        ),
+        migrations.CreateModel(
+            name='BalanceEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(choices=[('SELLER', 'Seller profit'), ('OWNER', 'Owner balance'), ('BUSINESS', 'Business balance')], max_length=20)),
+                ('amount', models.IntegerField()),
+                ('description', models.CharField(max_length=100)),
+                ('compacted', models.BooleanField(default=False, help_text='Folded into the profile balances')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='balance_entries', to='inventory.companyprofile')),
+                ('seller', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='balance_entries', to='inventory.sellerprofile')),
+            ],
+            options={
+                'verbose_name_plural': 'balance entries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='balanceentry',
+            index=models.Index(condition=models.Q(('compacted', False)), fields=['seller', 'company'], name='balance_entry_pending'),
+        ),
+    ]
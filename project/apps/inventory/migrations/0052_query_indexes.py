@@ -0,0 +1,57 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:52
+
+from django.db import migrations, models
+
+# created_at follows insertion order, so BRIN serves date ranges at a fraction of a btree's size
+BRIN_INDEXES = [
+    ('inventory_cashorder', 'created_at'),
+]
+
+
+def create_brin_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in BRIN_INDEXES:
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS {0}_{1}_brin ON {0} USING brin ({1})'.format(table, column))
+
+
+def drop_brin_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in BRIN_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {}_{}_brin'.format(table, column))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0051_balanceentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cashorder',
+            index=models.Index(fields=['-updated_at', '-id'], name='cashorder_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='cashorderitem',
+            index=models.Index(fields=['-created_at'], name='cashorderitem_created'),
+        ),
+        migrations.AddIndex(
+            model_name='productstockin',
+            index=models.Index(fields=['-created_at', '-id'], name='stock_created'),
+        ),
+        migrations.AddIndex(
+            model_name='productstockin',
+            index=models.Index(condition=models.Q(('available_stock__gt', 0)), fields=['-created_at', '-id'], name='stock_available_created'),
+        ),
+        migrations.AddIndex(
+            model_name='productstockin',
+            index=models.Index(condition=models.Q(('available_stock__gt', 0)), fields=['product', '-created_at'], name='stock_available_product'),
+        ),
+        migrations.AddIndex(
+            model_name='returncashorder',
+            index=models.Index(fields=['created_at'], name='returncashorder_created'),
+        ),
+        migrations.RunPython(create_brin_indexes, drop_brin_indexes),
+    ]
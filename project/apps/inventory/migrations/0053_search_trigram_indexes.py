@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# free-text search runs icontains, which Postgres compiles to UPPER(column) LIKE UPPER(%term%)
+TRIGRAM_INDEXES = [
+    ('inventory_product', 'name'),
+    ('inventory_vendor', 'name'),
+    ('inventory_sellerprofile', 'username'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS {0}_{1}_trgm ON {0} USING gin (UPPER({1}) gin_trgm_ops)'
+                              .format(table, column))
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {}_{}_trgm'.format(table, column))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0052_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0053_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='claim',
+            index=models.Index(fields=['status', 'created_at'], name='claim_status_created'),
+        ),
+        migrations.AddIndex(
+            model_name='credit',
+            index=models.Index(fields=['payment_status', 'created_at'], name='credit_status_created'),
+        ),
+    ]
@@ -1,21 +1,74 @@
 import string
 import random
-from django.db import models
-from django.db.models.signals import post_save
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import Count, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
+from collections import Counter
 import math
 
+from .caching import add_sold_imeis, bump_singleton, bump_stock_generation, get_singleton
+
 
 def generate_join_code(size=6, chars=string.ascii_uppercase + string.digits):
     return ''.join(random.choice(chars) for _ in range(size))
 
 
+class IMEINumberQuerySet(models.QuerySet):
+    def with_stock_lots(self, numbers):
+        """ Resolves many IMEIs to their stock lots in one query, rejecting IMEIs without exactly one lot. """
+        numbers = [str(number) for number in numbers]
+        imei_numbers = self.select_related('product_stock').in_bulk(numbers)
+        unattached = [number for number in numbers
+                      if number not in imei_numbers or imei_numbers[number].product_stock_id is None]
+        if unattached:
+            raise ValidationError("IMEI not attached to exactly one stock lot: {}".format(", ".join(unattached)))
+        return imei_numbers
+
+    def available(self, product_id):
+        """ IMEIs of the product that can be sold today. """
+        return self.filter(product_stock__product=product_id, status__in=IMEINumber.sellable_statuses) \
+            .order_by('number').values_list('number', flat=True)
+
+    def statuses(self, numbers):
+        """ Maps each number to its lifecycle status in lower case, or unknown, with one IN query. """
+        statuses = {number: "unknown" for number in numbers}
+        statuses.update((number, status.lower()) for number, status in
+                        self.filter(number__in=numbers).values_list('number', 'status'))
+        return statuses
+
+    def set_status(self, status):
+        """ Moves the IMEIs to a lifecycle status; cached availability is refreshed on commit. """
+        # register after the UPDATE: outside an atomic block on_commit runs at once
+        updated = self.update(status=status, updated_at=timezone.now())
+        transaction.on_commit(bump_stock_generation)
+        return updated
+
+
 class IMEINumber(models.Model):
+    status_choices = (
+        ('IN_STOCK', 'In Stock'),
+        ('SOLD', 'Sold'),
+        ('ON_CREDIT', 'On Credit'),
+        ('ON_CLAIM', 'On Claim'),
+        ('RETURNED', 'Returned'),
+    )
+    sellable_statuses = ("IN_STOCK", "RETURNED")
+
     number = models.CharField(max_length=200, unique=True, primary_key=True)
+    status = models.CharField(max_length=20, choices=status_choices, default="IN_STOCK", db_index=True,
+                              editable=False)
+    product_stock = models.ForeignKey('ProductStockIn', on_delete=models.SET_NULL, null=True, blank=True,
+                                      editable=False, related_name='imei_numbers')
 
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
 
+    objects = IMEINumberQuerySet.as_manager()
+
     def __str__(self):
         return self.number
 
@@ -40,6 +93,53 @@ class Product(models.Model):
         return self.name
 
 
+class ProductStockInQuerySet(models.QuerySet):
+    def move_stock(self, **deltas):
+        """ Applies counter deltas, e.g. move_stock(available_stock=-1, sold=1), as a single atomic UPDATE. """
+        changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+        if not changes:
+            return 0
+        changes['asset'] = F('purchasing_price') * changes.get('available_stock', F('available_stock'))
+        changes['updated_at'] = timezone.now()
+        updated = self.update(**changes)
+        transaction.on_commit(bump_stock_generation)
+        return updated
+
+    def move_stock_per_lot(self, product_stock_ids, **deltas):
+        """ Applies the deltas once per unit moved from each lot, one UPDATE per distinct unit count. """
+        lots_by_count = {}
+        for product_stock_id, count in Counter(product_stock_ids).items():
+            lots_by_count.setdefault(count, []).append(product_stock_id)
+        for count, lots in lots_by_count.items():
+            self.filter(id__in=lots).move_stock(**{field: delta * count for field, delta in deltas.items()})
+
+    def stock_in(self, lots):
+        """
+        Attaches IMEIs to freshly created lots with bulk inserts, given (lot, numbers) pairs. Unknown IMEIs
+        are created, IMEIs already held by a lot are rejected, and the M2M rows of all lots go in one insert.
+        Call it inside a transaction so a rejected delivery leaves nothing behind.
+        """
+        numbers = [(lot, str(number)) for lot, lot_numbers in lots for number in lot_numbers]
+        repeated = [number for number, count in Counter(number for lot, number in numbers).items() if count > 1]
+        if repeated:
+            raise ValidationError("IMEI listed more than once: {}".format(", ".join(repeated)))
+
+        IMEINumber.objects.bulk_create([IMEINumber(number=number) for lot, number in numbers], ignore_conflicts=True)
+        attached = IMEINumber.objects.filter(number__in=[number for lot, number in numbers]) \
+            .exclude(product_stock=None).values_list('number', flat=True)
+        if attached:
+            raise ValidationError("IMEI already attached to another stock lot: {}".format(", ".join(attached)))
+
+        # the through rows are inserted directly, so the FK and status kept by sync_imei_stock_lot are set here
+        through = self.model.imei_or_serial_number.through
+        through.objects.bulk_create([through(productstockin_id=lot.id, imeinumber_id=number) for lot, number in numbers])
+        for lot, lot_numbers in lots:
+            IMEINumber.objects.filter(number__in=[str(number) for number in lot_numbers]).update(
+                product_stock=lot, status="IN_STOCK", updated_at=timezone.now()
+            )
+        transaction.on_commit(bump_stock_generation)
+
+
 class ProductStockIn(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE)
@@ -54,6 +154,17 @@ class ProductStockIn(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
 
+    objects = ProductStockInQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='stock_created'),
+            models.Index(fields=['-created_at', '-id'], condition=Q(available_stock__gt=0),
+                         name='stock_available_created'),
+            models.Index(fields=['product', '-created_at'], condition=Q(available_stock__gt=0),
+                         name='stock_available_product'),
+        ]
+
     def __str__(self):
         return self.product.name
 
@@ -62,23 +173,95 @@ class ProductStockIn(models.Model):
         super(ProductStockIn, self).save(*args, **kwargs)
 
 
+@receiver(post_delete, sender=ProductStockIn, dispatch_uid="product_stock_deleted")
+def product_stock_deleted(sender, instance, **kwargs):
+    transaction.on_commit(bump_stock_generation)
+
+
+@receiver(m2m_changed, sender=ProductStockIn.imei_or_serial_number.through, dispatch_uid="sync_imei_stock_lot")
+def sync_imei_stock_lot(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Keeps IMEINumber.product_stock in step with the lot's imei_or_serial_number M2M. """
+    if action.startswith("post_"):
+        transaction.on_commit(bump_stock_generation)
+    if reverse:
+        imei_numbers = IMEINumber.objects.filter(number=instance.number)
+        lots = pk_set or set()
+        if action == "pre_add" and (len(lots) > 1 or imei_numbers.exclude(product_stock=None)
+                                    .exclude(product_stock__in=lots).exists()):
+            raise ValidationError("IMEI already attached to a stock lot: {}".format(instance.number))
+        elif action == "post_add":
+            imei_numbers.update(product_stock=next(iter(lots)))
+        elif action == "post_remove":
+            imei_numbers.filter(product_stock__in=lots).update(product_stock=None)
+        elif action == "post_clear":
+            imei_numbers.update(product_stock=None)
+        return
+
+    if action == "pre_add":
+        attached = IMEINumber.objects.filter(number__in=pk_set).exclude(product_stock=None) \
+            .exclude(product_stock=instance).values_list('number', flat=True)
+        if attached:
+            raise ValidationError("IMEI already attached to another stock lot: {}".format(", ".join(attached)))
+    elif action == "post_add":
+        IMEINumber.objects.filter(number__in=pk_set).update(product_stock=instance)
+    elif action == "post_remove":
+        IMEINumber.objects.filter(number__in=pk_set, product_stock=instance).update(product_stock=None)
+    elif action == "post_clear":
+        IMEINumber.objects.filter(product_stock=instance).update(product_stock=None)
+
+
+class SellerProfileQuerySet(models.QuerySet):
+    def with_balance(self):
+        """ Annotates each seller with closed_profit, its running profit at the last week closure. """
+        return self.with_pending_profit().annotate(closed_profit=Coalesce(Subquery(
+            SellerClosure.objects.filter(seller=OuterRef('pk'))
+            .order_by('-week_closure').values('closing_profit')[:1]
+        ), 0))
+
+    def with_pending_profit(self):
+        """ Annotates each seller with pending_profit, the sum of its ledger entries not compacted yet. """
+        return self.annotate(pending_profit=Coalesce(Subquery(
+            BalanceEntry.objects.filter(seller=OuterRef('pk'), compacted=False)
+            .values('seller').annotate(total=Sum('amount')).values('total')
+        ), 0))
+
+
 class SellerProfile(models.Model):
     username = models.CharField(max_length=54)
-    profit = models.IntegerField(default=0)
+    profit = models.IntegerField(default=0, help_text="Compacted running total, pending ledger entries are added on read")
     business_share = models.PositiveIntegerField()
     seller_share = models.PositiveIntegerField()
 
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
 
+    objects = SellerProfileQuerySet.as_manager()
+
     def __str__(self):
         return self.username
 
+    @property
+    def running_profit(self):
+        """ Compacted profit plus the ledger entries not folded into it yet. """
+        if not hasattr(self, 'pending_profit'):
+            self.pending_profit = self.balance_entries.filter(compacted=False) \
+                .aggregate(total=Coalesce(Sum('amount'), 0))['total']
+        return self.profit + self.pending_profit
+
+    @property
+    def balance(self):
+        """ Profit earned since the last week closure. """
+        if not hasattr(self, 'closed_profit'):
+            self.closed_profit = self.sellerclosure_set.order_by('-week_closure') \
+                .values_list('closing_profit', flat=True).first() or 0
+        return self.running_profit - self.closed_profit
+
 
 class CompanyProfile(models.Model):
     owner_name = models.CharField(max_length=54)
-    owner_balance = models.IntegerField(default=0)
-    business_balance = models.IntegerField(default=0)
+    owner_balance = models.IntegerField(default=0, help_text="Compacted total, pending ledger entries are added on read")
+    business_balance = models.IntegerField(default=0, help_text="Compacted running total, the balance is counted "
+                                                                "from the last closure")
 
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
@@ -86,6 +269,29 @@ class CompanyProfile(models.Model):
     def __str__(self):
         return self.owner_name
 
+    @property
+    def pending_balances(self):
+        """ Owner and business amounts of the ledger entries not compacted yet. """
+        if not hasattr(self, '_pending_balances'):
+            self._pending_balances = self.balance_entries.filter(compacted=False).aggregate(
+                owner=Coalesce(Sum('amount', filter=Q(account="OWNER")), 0),
+                business=Coalesce(Sum('amount', filter=Q(account="BUSINESS")), 0),
+            )
+        return self._pending_balances
+
+    @property
+    def running_owner_balance(self):
+        return self.owner_balance + self.pending_balances['owner']
+
+    @property
+    def running_business_balance(self):
+        return self.business_balance + self.pending_balances['business']
+
+    @property
+    def current_business_balance(self):
+        """ Business balance accumulated since the last week closure. """
+        return self.running_business_balance - WeekClosure.last_closing_business_balance()
+
 
 class Setting(models.Model):
     status_choices = (
@@ -101,6 +307,14 @@ class Setting(models.Model):
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
 
 
+@receiver(post_save, sender=Setting, dispatch_uid="refresh_setting")
+@receiver(post_delete, sender=Setting, dispatch_uid="refresh_setting_deleted")
+@receiver(post_save, sender=CompanyProfile, dispatch_uid="refresh_company_profile")
+@receiver(post_delete, sender=CompanyProfile, dispatch_uid="refresh_company_profile_deleted")
+def refresh_singleton(sender, **kwargs):
+    transaction.on_commit(lambda: bump_singleton(sender))
+
+
 class CashOrder(models.Model):
     unique_id = models.CharField(max_length=10, default=generate_join_code, unique=True)
     customer_name = models.CharField(max_length=54, null=True, blank=True)
@@ -113,9 +327,34 @@ class CashOrder(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-updated_at', '-id'], name='cashorder_updated'),
+        ]
+
     def __str__(self):
         return self.unique_id
 
+    def calculate_total_values(self):
+        """ Computes amount, profit and quantity of the order in a single aggregate query. """
+        totals = self.cashorderitem_set.aggregate(
+            quantity=Count('id'),
+            amount=Coalesce(Sum('price'), 0),
+            profit=Coalesce(Sum(ExpressionWrapper(F('price') - F('product_stock__purchasing_price'),
+                                                  output_field=models.IntegerField())), 0),
+        )
+        self.total_amount = totals['amount']
+        self.total_profit = totals['profit']
+        self.quantity = totals['quantity']
+        self.save(update_fields=['total_amount', 'total_profit', 'quantity', 'updated_at'])
+
+        if not Transaction.objects.filter(order=self).exists():
+            Transaction.objects.create(
+                order=self,
+                seller=self.sale_by,
+                company=get_singleton(CompanyProfile)
+            )
+
 
 class CashOrderItem(models.Model):
     cash_order = models.ForeignKey(CashOrder, on_delete=models.CASCADE, null=True, blank=True)
@@ -126,44 +365,28 @@ class CashOrderItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='cashorderitem_created'),
+        ]
+
     def __str__(self):
         return self.product_stock.product.name
 
-    def calculate_total_values(self):
-        order_items = CashOrderItem.objects.filter(cash_order=self.cash_order.id)
-
-        total_quantity = len(order_items)
-        amount = 0
-        profit = 0
-        for item in order_items:
-            amount += item.price
-            product_stock = ProductStockIn.objects.get(imei_or_serial_number=item.imei_or_serial_number)
-            profit += item.price - product_stock.purchasing_price
-
-        order = CashOrder.objects.get(id=self.cash_order.id)
-        order.total_amount = amount
-        order.total_profit = profit
-        order.quantity = total_quantity
-        order.save()
-
-        if len(Transaction.objects.filter(order=order)) == 0:
-            Transaction.objects.create(
-                order=order,
-                seller=order.sale_by,
-                company=CompanyProfile.objects.get()
-            )
-
     def save(self, *args, **kwargs):
+        if self.product_stock_id is None:
+            self.product_stock_id = self.imei_or_serial_number.product_stock_id
         super(CashOrderItem, self).save(*args, **kwargs)
-        self.calculate_total_values()
 
 
 @receiver(post_save, sender=CashOrderItem, dispatch_uid="update_stock_count")
-def update_stock(sender, instance, **kwargs):
-    product_stock = ProductStockIn.objects.get(imei_or_serial_number=instance.imei_or_serial_number)
-    product_stock.available_stock -= 1
-    product_stock.sold += 1
-    product_stock.save()
+def update_stock(sender, instance, created, **kwargs):
+    ProductStockIn.objects.filter(
+        imei_numbers=instance.imei_or_serial_number_id
+    ).move_stock(available_stock=-1, sold=1)
+    IMEINumber.objects.filter(number=instance.imei_or_serial_number_id).set_status("SOLD")
+    if created:
+        transaction.on_commit(lambda: add_sold_imeis([instance.imei_or_serial_number_id]))
 
 
 class ReturnCashOrder(models.Model):
@@ -180,46 +403,48 @@ class ReturnCashOrder(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='returncashorder_created'),
+        ]
+
     def __str__(self):
         return self.cash_order.unique_id
 
+    @transaction.atomic
     def save(self, *args, **kwargs):
-        seller = SellerProfile.objects.get(id=self.cash_order.sale_by.id)
+        seller = self.cash_order.sale_by
+        seller_profit = 0
 
         if self.reason == "NOT_INTERESTED":
-            cash_order_items = CashOrderItem.objects.filter(cash_order=self.cash_order)
-            return_amount = 0
-            for item in cash_order_items:
-                product_stock = ProductStockIn.objects.get(imei_or_serial_number=item.imei_or_serial_number)
-                return_amount += product_stock.purchasing_price
-            self.return_amount = return_amount
+            # the lot stored on each item at sale time, the same cost basis as the order profit
+            self.return_amount = CashOrderItem.objects.filter(cash_order=self.cash_order).aggregate(
+                return_amount=Coalesce(Sum('product_stock__purchasing_price'), 0)
+            )['return_amount']
         elif self.reason == "ISSUE":
             self.return_amount = self.cash_order.total_amount
 
             # seller share calculated from profit
-            seller_profit = ((self.cash_order.total_profit * seller.seller_share) / 100)
-            seller.profit -= seller_profit
+            seller_profit -= ((self.cash_order.total_profit * seller.seller_share) / 100)
         else:
             # calculate profit
             sale_price = self.cash_order.total_amount
             profit = sale_price - self.return_amount
 
             # profit added
-            seller_profit = ((profit * seller.seller_share) / 100)
-            seller.profit += seller_profit
+            seller_profit += ((profit * seller.seller_share) / 100)
 
             # previous profit deducted
-            seller_prev_profit = ((self.cash_order.total_profit * seller.seller_share) / 100)
-            seller.profit -= seller_prev_profit
+            seller_profit -= ((self.cash_order.total_profit * seller.seller_share) / 100)
 
-        seller.save()
+        BalanceEntry.objects.record("Return {}".format(self.cash_order.unique_id),
+                                    seller=seller, seller_profit=seller_profit)
 
-        cash_order_items = CashOrderItem.objects.filter(cash_order=self.cash_order.id)
-
-        for items in cash_order_items:
-            product_stock = ProductStockIn.objects.get(id=items.product_stock.id)
-            product_stock.available_stock += 1
-            product_stock.save()
+        ProductStockIn.objects.move_stock_per_lot(
+            CashOrderItem.objects.filter(cash_order=self.cash_order.id).values_list('product_stock', flat=True),
+            available_stock=1,
+        )
+        IMEINumber.objects.filter(cashorderitem__cash_order=self.cash_order.id).set_status("RETURNED")
 
         super(ReturnCashOrder, self).save(*args, **kwargs)
 
@@ -241,19 +466,81 @@ class Transaction(models.Model):
         self.total_profit = total_profit
         self.seller_profit = ((total_profit * self.seller.seller_share) / 100)
 
-        settings = Setting.objects.filter().first()
+        settings = get_singleton(Setting)
         self.owner_profit = ((total_profit * settings.owner_share) / 100)
         self.business_profit = ((total_profit * self.seller.business_share) / 100)
 
-        seller = SellerProfile.objects.get(id=self.seller.id)
-        seller.profit += self.seller_profit
-        seller.save()
+        # recorded in the ledger so concurrent sales never wait on the seller or company rows
+        with transaction.atomic():
+            BalanceEntry.objects.record("Sale {}".format(self.order.unique_id),
+                                        seller=self.seller, seller_profit=self.seller_profit,
+                                        company=self.company, owner_balance=self.owner_profit,
+                                        business_balance=self.business_profit)
+            super(Transaction, self).save(*args, **kwargs)
+
+
+class BalanceEntryQuerySet(models.QuerySet):
+    def record(self, description, seller=None, seller_profit=0, company=None, owner_balance=0, business_balance=0):
+        """ Appends one entry per non-zero amount. """
+        amounts = [("SELLER", seller, None, seller_profit),
+                   ("OWNER", None, company, owner_balance),
+                   ("BUSINESS", None, company, business_balance)]
+        return self.bulk_create([
+            BalanceEntry(account=account, seller=entry_seller, company=entry_company, amount=int(amount),
+                         description=description)
+            for account, entry_seller, entry_company, amount in amounts if int(amount)
+        ])
+
+    def compact(self):
+        """
+        Folds the pending entries into SellerProfile.profit and the CompanyProfile balances.
+        Compactions are serialized on the company row; sales keep appending meanwhile, and entries
+        committed after the pending ids are read are left for the next compaction.
+        """
+        with transaction.atomic():
+            list(CompanyProfile.objects.select_for_update().values_list('id', flat=True))
+            pending = self.filter(id__in=list(self.filter(compacted=False).values_list('id', flat=True)))
+
+            for seller_id, total in pending.filter(account="SELLER").values_list('seller') \
+                    .annotate(total=Sum('amount')).order_by():
+                SellerProfile.objects.filter(id=seller_id).update(profit=F('profit') + total)
+            for company_id, owner, business in pending.exclude(account="SELLER").values_list('company').annotate(
+                    owner=Coalesce(Sum('amount', filter=Q(account="OWNER")), 0),
+                    business=Coalesce(Sum('amount', filter=Q(account="BUSINESS")), 0)).order_by():
+                CompanyProfile.objects.filter(id=company_id).update(owner_balance=F('owner_balance') + owner,
+                                                                    business_balance=F('business_balance') + business)
+            transaction.on_commit(lambda: bump_singleton(CompanyProfile))
+            return pending.update(compacted=True)
+
+
+class BalanceEntry(models.Model):
+    account_choices = (
+        ('SELLER', 'Seller profit'),
+        ('OWNER', 'Owner balance'),
+        ('BUSINESS', 'Business balance'),
+    )
+    account = models.CharField(max_length=20, choices=account_choices)
+    seller = models.ForeignKey(SellerProfile, on_delete=models.CASCADE, null=True, blank=True,
+                               related_name='balance_entries')
+    company = models.ForeignKey(CompanyProfile, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='balance_entries')
+    amount = models.IntegerField()
+    description = models.CharField(max_length=100)
+    compacted = models.BooleanField(default=False, help_text="Folded into the profile balances")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BalanceEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name_plural = "balance entries"
+        indexes = [
+            models.Index(fields=['seller', 'company'], condition=Q(compacted=False), name='balance_entry_pending'),
+        ]
 
-        company = CompanyProfile.objects.get(id=self.company.id)
-        company.owner_balance += self.owner_profit
-        company.business_balance += self.business_profit
-        company.save()
-        super(Transaction, self).save(*args, **kwargs)
+    def __str__(self):
+        return "{} {}".format(self.account, self.amount)
 
 
 class Credit(models.Model):
@@ -267,6 +554,11 @@ class Credit(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['payment_status', 'created_at'], name='credit_status_created'),
+        ]
+
     def __str__(self):
         return self.payment_status
 
@@ -291,15 +583,14 @@ class CreditItem(models.Model):
         credit.quantity = quantity
         credit.save()
 
-        product_stock = ProductStockIn.objects.get(imei_or_serial_number=self.imei_or_serial_number.number)
+        product_stock = ProductStockIn.objects.filter(imei_numbers=self.imei_or_serial_number_id)
+        imei_number = IMEINumber.objects.filter(number=self.imei_or_serial_number_id)
         if credit.payment_status == "PENDING":
-            product_stock.on_credit += 1
-            product_stock.available_stock -= 1
-            product_stock.save()
+            product_stock.move_stock(on_credit=1, available_stock=-1)
+            imei_number.set_status("ON_CREDIT")
         else:
-            product_stock.on_credit -= 1
-            product_stock.sold += 1
-            product_stock.save()
+            product_stock.move_stock(on_credit=-1, sold=1)
+            imei_number.set_status("SOLD")
 
 
 class Claim(models.Model):
@@ -315,27 +606,60 @@ class Claim(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='claim_status_created'),
+        ]
+
     def __str__(self):
         return self.product_stock.product.name
 
     def save(self, *args, **kwargs):
+        previous_status = None
+        if self.id:
+            previous_status = Claim.objects.filter(id=self.id).values_list('status', flat=True).first()
         super(Claim, self).save(*args, **kwargs)
-        product_stock = ProductStockIn.objects.get(imei_or_serial_number=self.imei_or_serial_number.number)
+        if self.status == previous_status:
+            return
+        product_stock = ProductStockIn.objects.filter(imei_numbers=self.imei_or_serial_number_id)
+        imei_number = IMEINumber.objects.filter(number=self.imei_or_serial_number_id)
         if self.status == "PENDING":
-            product_stock.on_claim += 1
-            product_stock.available_stock -= 1
+            product_stock.move_stock(on_claim=1, available_stock=-1)
+            imei_number.set_status("ON_CLAIM")
         else:
-            product_stock.on_claim -= 1
-            product_stock.available_stock += 1
-        product_stock.save()
+            product_stock.move_stock(on_claim=-1, available_stock=1)
+            imei_number.set_status("IN_STOCK")
 
 
 class WeekClosure(models.Model):
     total_profit = models.IntegerField()
     business_profit = models.IntegerField()
+    closing_business_balance = models.IntegerField(default=0, help_text="Running business balance at closure")
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return str(self.created_at.strftime("%d-%m-%Y %H:%M:%S"))
+
+    @classmethod
+    def last_closing_business_balance(cls):
+        return cls.objects.order_by('-id').values_list('closing_business_balance', flat=True).first() or 0
+
+
+class SellerClosure(models.Model):
+    week_closure = models.ForeignKey(WeekClosure, on_delete=models.CASCADE, related_name='sellers')
+    seller = models.ForeignKey(SellerProfile, on_delete=models.CASCADE)
+    profit = models.IntegerField(help_text="Profit earned during the closed week")
+    closing_profit = models.IntegerField(help_text="Running seller profit at closure")
+    business_share = models.PositiveIntegerField()
+    seller_share = models.PositiveIntegerField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('seller', 'week_closure')
+
+    def __str__(self):
+        return self.seller.username
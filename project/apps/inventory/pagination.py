@@ -0,0 +1,69 @@
+import json
+
+from django.db import connections
+from rest_framework.pagination import CursorPagination
+
+
+def plan_rows(plan):
+    """ Returns the planner's row estimate from EXPLAIN (FORMAT JSON) output, as decoded by psycopg2 or as text. """
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class ApproximateCountCursorPagination(CursorPagination):
+    """
+    Provides keyset pages whose cost does not grow with depth. No COUNT(*) is run; with ?count=approximate
+    the planner's row estimate is returned as count on Postgres, other databases count exactly.
+    """
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.approximate_count = None
+        if request.query_params.get(self.count_query_param) == 'approximate':
+            self.approximate_count = self.get_approximate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_approximate_count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return queryset.count()
+        # QuerySet.explain(format='json') returns the Python repr of the plan, so EXPLAIN is run directly
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            return plan_rows(cursor.fetchone()[0])
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.approximate_count is not None:
+            response.data['count'] = self.approximate_count
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        schema = super().get_paginated_response_schema(schema)
+        schema['properties']['count'] = {'type': 'integer', 'example': 123}
+        return schema
+
+
+class CashOrderCursorPagination(ApproximateCountCursorPagination):
+    ordering = ('-updated_at', '-id')
+
+
+class ProductStockInCursorPagination(ApproximateCountCursorPagination):
+    ordering = ('-created_at', '-id')
+
+
+class CursorPaginationMixin:
+    """ Pages with cursor_pagination_class when the client sends ?pagination=cursor or a cursor. """
+    cursor_pagination_class = None
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class() if self.pagination_class else None
+        return self._paginator
@@ -8,7 +8,8 @@ class IMEISerializer(ModelSerializer):
     class Meta:
         model = IMEINumber
         fields = [
-            'number'
+            'number',
+            'status',
         ]
 
 
@@ -32,7 +33,7 @@ class ProductStockInSerializer(ModelSerializer):
         return obj.product.name
 
     def get_vendor(self, obj):
-        return VendorSerializer(Vendor.objects.get(id=obj.vendor.id), many=False).data
+        return VendorSerializer(obj.vendor, many=False).data
 
     class Meta:
         model = ProductStockIn
@@ -44,6 +45,17 @@ class SellerProfileSerializer(ModelSerializer):
         model = SellerProfile
         fields = '__all__'
 
+    def to_representation(self, instance):
+        # profit is exposed as the balance since the last week closure
+        data = super().to_representation(instance)
+        data['profit'] = instance.balance
+        return data
+
+    def validate_profit(self, value):
+        if self.instance:
+            return value + self.instance.profit - self.instance.balance
+        return value
+
 
 class SettingSerializer(ModelSerializer):
     class Meta:
@@ -77,7 +89,7 @@ class CashOrderSerializer(ModelSerializer):
         return obj.sale_by.username
 
     def get_items(self, obj):
-        return CashOrderItemSerializer(CashOrderItem.objects.filter(cash_order=obj.id), many=True).data
+        return CashOrderItemSerializer(obj.cashorderitem_set.all(), many=True).data
 
 
 class CreditItemSerializer(ModelSerializer):
@@ -99,7 +111,7 @@ class CreditSerializer(ModelSerializer):
         fields = '__all__'
 
     def get_items(self, obj):
-        return CreditItemSerializer(CreditItem.objects.filter(credit=obj.id), many=True).data
+        return CreditItemSerializer(obj.credititem_set.all(), many=True).data
 
 
 class ClaimSerializer(ModelSerializer):
@@ -125,11 +137,7 @@ class ReturnCashOrderSerializer(ModelSerializer):
         fields = '__all__'
 
     def get_cashorder_detail(self, obj):
-        try:
-            return CashOrderSerializer(CashOrder.objects.filter(id=obj.cash_order.id), many=True).data
-        except Exception as e:
-            print(e)
-            return {}
+        return CashOrderSerializer([obj.cash_order], many=True).data
 
 
 class CompanyProfileSerializer(ModelSerializer):
@@ -137,8 +145,38 @@ class CompanyProfileSerializer(ModelSerializer):
         model = CompanyProfile
         fields = "__all__"
 
+    def to_representation(self, instance):
+        # balances include the pending ledger entries, business_balance counts from the last week closure
+        data = super().to_representation(instance)
+        data['owner_balance'] = instance.running_owner_balance
+        data['business_balance'] = instance.current_business_balance
+        return data
+
+    def validate_owner_balance(self, value):
+        if self.instance:
+            return value + self.instance.owner_balance - self.instance.running_owner_balance
+        return value
+
+    def validate_business_balance(self, value):
+        if self.instance:
+            return value + self.instance.business_balance - self.instance.current_business_balance
+        return value + WeekClosure.last_closing_business_balance()
+
+
+class SellerClosureSerializer(ModelSerializer):
+    username = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = SellerClosure
+        fields = ['id', 'seller', 'username', 'profit', 'closing_profit', 'business_share', 'seller_share']
+
+    def get_username(self, obj):
+        return obj.seller.username
+
 
 class WeekClosureSerializer(ModelSerializer):
+    sellers = SellerClosureSerializer(many=True, read_only=True)
+
     class Meta:
         model = WeekClosure
         fields = "__all__"
@@ -1,3 +1,1123 @@
+import csv
+import datetime
+import json
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import caching
+from .caching import get_singleton
+from .pagination import plan_rows
+from .utils import render_pdf
+from .models import *
+
+
+class QueryIndexTests(TestCase):
+    """
+    Checks that the planner picks the intended index for the hot list and export queries. The planner
+    is not forced: a year of data is seeded with production-like selectivity (most lots sold out, most
+    credits and claims cleared) and ANALYZEd, and list queries are paged as the endpoints page them.
+    """
+    page = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        vendor = Vendor.objects.create(name="Vendor")
+        seller = SellerProfile.objects.create(username="seller", business_share=50, seller_share=40)
+        products = cls.seed([Product(name="Phone {}".format(i)) for i in range(50)])
+        lots = cls.seed([
+            ProductStockIn(product=products[i % 50], vendor=vendor, purchasing_price=100,
+                           available_stock=(i % 3) + 1 if i >= 2850 else 0)
+            for i in range(3000)
+        ], 'created_at')
+        imei_numbers = cls.seed([IMEINumber(number="{:015d}".format(i)) for i in range(5000)])
+        cash_orders = cls.seed([CashOrder(sale_by=seller, unique_id="O{:05d}".format(i)) for i in range(5000)],
+                               'created_at', 'updated_at')
+        cls.seed([CashOrderItem(cash_order=cash_order, price=150, imei_or_serial_number=imei_number,
+                                product_stock=lots[i % 3000])
+                  for i, (cash_order, imei_number) in enumerate(zip(cash_orders, imei_numbers))], 'created_at')
+        cls.seed([ReturnCashOrder(cash_order=cash_order, reason="NOT_INTERESTED") for cash_order in cash_orders[::10]],
+                 'created_at')
+        cls.seed([Credit(payment_status="CLEARED" if i % 10 else "PENDING") for i in range(3000)], 'created_at')
+        cls.seed([Claim(product_stock=lots[i], imei_or_serial_number=imei_numbers[i], reason="Screen",
+                        status="CLEARED" if i % 10 else "PENDING")
+                  for i in range(2000)], 'created_at')
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        cls.product = products[0]
+
+    @staticmethod
+    def seed(objects, *date_fields):
+        """ Inserts the rows and dates them evenly over the last year in insertion order. """
+        model = type(objects[0])
+        model.objects.bulk_create(objects, batch_size=500)
+        objects = list(model.objects.order_by('pk'))
+        if date_fields:
+            now = timezone.now()
+            for day in range(365):
+                pks = [obj.pk for obj in objects[len(objects) * day // 365:len(objects) * (day + 1) // 365]]
+                moment = now - datetime.timedelta(days=365 - day)
+                model.objects.filter(pk__in=pks).update(**{field: moment for field in date_fields})
+        return objects
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def last_week(self):
+        end = timezone.now()
+        return [end - datetime.timedelta(days=7), end]
+
+    def test_available_stock(self):
+        self.assertUsesIndex(ProductStockIn.objects.filter(available_stock__gt=0)
+                             .order_by('-created_at', '-id')[:self.page], 'stock_available_created')
+
+    def test_available_stock_of_product(self):
+        self.assertUsesIndex(ProductStockIn.objects.filter(available_stock__gt=0, product=self.product)
+                             .order_by('-created_at'), 'stock_available_product')
+
+    def test_stock_list(self):
+        self.assertUsesIndex(ProductStockIn.objects.order_by('-created_at', '-id')[:self.page], 'stock_created')
+
+    def test_cash_order_list(self):
+        self.assertUsesIndex(CashOrder.objects.order_by('-updated_at', '-id')[:self.page], 'cashorder_updated')
+
+    def test_cash_order_export(self):
+        self.assertUsesIndex(CashOrder.objects.filter(updated_at__range=self.last_week()), 'cashorder_updated')
+
+    def test_return_export(self):
+        self.assertUsesIndex(ReturnCashOrder.objects.filter(created_at__range=self.last_week()),
+                             'returncashorder_created')
+
+    def test_cash_order_item_list(self):
+        self.assertUsesIndex(CashOrderItem.objects.order_by('-created_at')[:self.page], 'cashorderitem_created')
+
+    def test_credit_filter(self):
+        self.assertUsesIndex(Credit.objects.filter(payment_status="CLEARED", created_at__range=self.last_week()),
+                             'credit_status_created')
+
+    def test_claim_filter(self):
+        self.assertUsesIndex(Claim.objects.filter(status="PENDING").order_by('created_at')[:self.page],
+                             'claim_status_created')
+
+
+class InventoryTestCase(TestCase):
+    """ One product in three lots of ten IMEIs priced 100, 101 and 102, and a seller on a 40% share. """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('cashier', password='password'))
+        Setting.objects.create(owner_share=10)
+        self.company = CompanyProfile.objects.create(owner_name="Owner")
+        self.seller = SellerProfile.objects.create(username="seller", business_share=50, seller_share=40)
+        self.product = Product.objects.create(name="Phone")
+        self.vendor = Vendor.objects.create(name="Vendor")
+        self.lots = []
+        for lot_number in range(3):
+            lot = ProductStockIn.objects.create(product=self.product, vendor=self.vendor,
+                                                purchasing_price=100 + lot_number, available_stock=10)
+            numbers = [self.imei(lot_number, i) for i in range(10)]
+            IMEINumber.objects.bulk_create([IMEINumber(number=number) for number in numbers])
+            lot.imei_or_serial_number.set(numbers)
+            self.lots.append(lot)
+
+    def imei(self, lot_number, i):
+        return "{}{:014d}".format(lot_number, i)
+
+    def sell(self, numbers, price=150):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/v1/cashorder/', {
+                'sale_by': self.seller.id, 'customer_name': "Customer", 'warranty': 0,
+                'items': [{'imei_or_serial_number': number, 'price': price} for number in numbers],
+            }, format='json')
+
+    def lot(self, lot_number):
+        return ProductStockIn.objects.get(id=self.lots[lot_number].id)
+
+    def list_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.data['results']
+
+
+class CashOrderCreateTests(InventoryTestCase):
+    def test_bulk_sale(self):
+        numbers = [self.imei(0, i) for i in range(5)] + [self.imei(1, i) for i in range(3)]
+        get_singleton(Setting), get_singleton(CompanyProfile)
+        with self.assertNumQueries(18):
+            response = self.client.post('/api/v1/cashorder/', {
+                'sale_by': self.seller.id, 'customer_name': "Customer", 'warranty': 0,
+                'items': [{'imei_or_serial_number': number, 'price': 150} for number in numbers],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['quantity'], response.data['total_amount']), (8, 1200))
+        self.assertEqual(response.data['total_profit'], 5 * 50 + 3 * 49)
+
+        self.assertEqual((self.lot(0).available_stock, self.lot(0).sold, self.lot(0).asset), (5, 5, 500))
+        self.assertEqual((self.lot(1).available_stock, self.lot(1).sold, self.lot(1).asset), (7, 3, 707))
+        self.assertEqual((self.lot(2).available_stock, self.lot(2).sold), (10, 0))
+        self.assertEqual(IMEINumber.objects.filter(status="SOLD").count(), 8)
+
+    def test_json_number_imei(self):
+        response = self.sell([int(self.imei(1, 4))])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(CashOrderItem.objects.get().imei_or_serial_number_id, self.imei(1, 4))
+
+    def test_unknown_imei_sells_nothing(self):
+        response = self.sell([self.imei(0, 0), "999999999999999"])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CashOrder.objects.exists())
+        self.assertEqual((self.lot(0).available_stock, self.lot(0).sold), (10, 0))
+        self.assertEqual(IMEINumber.objects.get(number=self.imei(0, 0)).status, "IN_STOCK")
+
+
+class CashOrderTotalsTests(InventoryTestCase):
+    def test_totals(self):
+        self.sell([self.imei(0, 0), self.imei(1, 0), self.imei(2, 0)], price=120)
+        cash_order = CashOrder.objects.get()
+        self.assertEqual((cash_order.quantity, cash_order.total_amount, cash_order.total_profit), (3, 360, 57))
+        self.assertEqual(Transaction.objects.get(order=cash_order).total_profit, 57)
+
+        cash_order.calculate_total_values()
+        self.assertEqual(Transaction.objects.filter(order=cash_order).count(), 1)
+
+    def test_return_uses_the_cost_of_the_sold_lot(self):
+        self.sell([self.imei(0, 0), self.imei(1, 0)])
+        IMEINumber.objects.filter(number=self.imei(0, 0)).update(product_stock=self.lots[2])
+        response = self.client.post('/api/v1/return-cashorder/', {'cash_order': CashOrder.objects.get().id,
+                                                                  'reason': "NOT_INTERESTED"}, format='json')
+        self.assertEqual(response.data['return_amount'], 100 + 101)
+        self.assertEqual((self.lot(0).available_stock, self.lot(2).available_stock), (10, 10))
+
+
+class StockCounterTests(InventoryTestCase):
+    def counters(self, lot_number):
+        lot = self.lot(lot_number)
+        return lot.available_stock, lot.sold, lot.on_credit, lot.on_claim, lot.asset
+
+    def claim(self, number, lot_number):
+        response = self.client.post('/api/v1/claim/', {'product_stock': self.lots[lot_number].id, 'reason': "Screen",
+                                                       'imei_or_serial_number': number}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def test_move_stock(self):
+        lots = ProductStockIn.objects.filter(id__in=[self.lots[0].id, self.lots[1].id])
+        self.assertEqual(lots.move_stock(available_stock=-2, sold=2), 2)
+        self.assertEqual(self.counters(0), (8, 2, 0, 0, 800))
+        self.assertEqual(self.counters(1), (8, 2, 0, 0, 808))
+        self.assertEqual(lots.move_stock(available_stock=0), 0)
+
+    def test_move_stock_per_lot(self):
+        ProductStockIn.objects.move_stock_per_lot([self.lots[0].id] * 3 + [self.lots[2].id], available_stock=-1, sold=1)
+        self.assertEqual(self.counters(0), (7, 3, 0, 0, 700))
+        self.assertEqual(self.counters(1), (10, 0, 0, 0, 1010))
+        self.assertEqual(self.counters(2), (9, 1, 0, 0, 918))
+
+    def test_order_delete(self):
+        self.sell([self.imei(0, 0), self.imei(0, 1)])
+        self.client.delete('/api/v1/cashorder/{}/'.format(CashOrder.objects.get().id))
+        self.assertEqual((self.lot(0).available_stock, self.lot(0).asset), (10, 1000))
+
+    def test_credit(self):
+        response = self.client.post('/api/v1/credit/', {'payment_status': "PENDING", 'items': [
+            {'imei_or_serial_number': self.imei(1, 0), 'price': 150},
+            {'imei_or_serial_number': self.imei(1, 1), 'price': 150},
+        ]}, format='json')
+        self.assertEqual(self.counters(1), (8, 0, 2, 0, 808))
+
+        credit_id = response.data['id']
+        self.client.put('/api/v1/credit/{}/'.format(credit_id), {'payment_status': "CLEARED"}, format='json')
+        self.assertEqual(self.counters(1), (8, 2, 0, 0, 808))
+
+        self.client.delete('/api/v1/credit/{}/'.format(credit_id))
+        self.assertEqual(self.counters(1), (10, 0, 0, 0, 1010))
+
+    def test_claim_cleared(self):
+        claim = self.claim(self.imei(2, 0), 2)
+        self.assertEqual(self.counters(2), (9, 0, 0, 1, 918))
+
+        response = self.client.put('/api/v1/claim/{}/'.format(claim['id']), dict(claim, status="CLEARED"),
+                                   format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counters(2), (10, 0, 0, 0, 1020))
+        self.assertEqual(IMEINumber.objects.get(number=self.imei(2, 0)).status, "IN_STOCK")
+
+    def test_claim_edit_keeps_counters(self):
+        claim = self.claim(self.imei(2, 0), 2)
+        self.client.put('/api/v1/claim/{}/'.format(claim['id']), dict(claim, reason="Battery"), format='json')
+        self.assertEqual(self.counters(2), (9, 0, 0, 1, 918))
+
+    def test_claim_delete(self):
+        claim = self.claim(self.imei(2, 0), 2)
+        self.client.delete('/api/v1/claim/{}/'.format(claim['id']))
+        self.assertEqual(self.counters(2), (10, 0, 0, 0, 1020))
+
+
+class IMEIStockLotTests(InventoryTestCase):
+    def stock_lot(self, number):
+        return IMEINumber.objects.get(number=number).product_stock_id
+
+    def test_lot_side_changes(self):
+        IMEINumber.objects.create(number="SN1")
+        self.lots[2].imei_or_serial_number.add("SN1")
+        self.assertEqual(self.stock_lot("SN1"), self.lots[2].id)
+
+        self.lots[2].imei_or_serial_number.remove("SN1")
+        self.assertIsNone(self.stock_lot("SN1"))
+
+        self.lots[0].imei_or_serial_number.clear()
+        self.assertFalse(IMEINumber.objects.filter(product_stock=self.lots[0]).exists())
+        self.assertEqual(self.stock_lot(self.imei(1, 0)), self.lots[1].id)
+
+    def test_imei_side_changes(self):
+        imei_number = IMEINumber.objects.create(number="SN1")
+        imei_number.productstockin_set.add(self.lots[1])
+        self.assertEqual(self.stock_lot("SN1"), self.lots[1].id)
+
+        imei_number.productstockin_set.clear()
+        self.assertIsNone(self.stock_lot("SN1"))
+
+    def test_one_lot_per_imei(self):
+        with self.assertRaises(ValidationError), transaction.atomic():
+            self.lots[1].imei_or_serial_number.add(self.imei(0, 0))
+        with self.assertRaises(ValidationError), transaction.atomic():
+            IMEINumber.objects.get(number=self.imei(0, 0)).productstockin_set.add(self.lots[1])
+        self.assertEqual(self.stock_lot(self.imei(0, 0)), self.lots[0].id)
+        self.assertEqual(self.lots[0].imei_or_serial_number.count(), 10)
+
+    def test_with_stock_lots(self):
+        with self.assertNumQueries(1):
+            imei_numbers = IMEINumber.objects.with_stock_lots([self.imei(0, 0), int(self.imei(2, 3))])
+            self.assertEqual([imei_numbers[number].product_stock.purchasing_price
+                              for number in [self.imei(0, 0), self.imei(2, 3)]], [100, 102])
+
+        IMEINumber.objects.create(number="SN1")
+        with self.assertRaisesMessage(ValidationError, "SN1, 999999999999999"):
+            IMEINumber.objects.with_stock_lots([self.imei(0, 0), "SN1", "999999999999999"])
+
+
+class OrderListTests(InventoryTestCase):
+    def return_order(self):
+        self.client.post('/api/v1/return-cashorder/', {'cash_order': CashOrder.objects.latest('id').id,
+                                                       'reason': "NOT_INTERESTED"}, format='json')
+
+    def test_cash_order_list(self):
+        self.sell([self.imei(0, 0), self.imei(1, 0)])
+        queries, orders = self.list_queries('/api/v1/cashorder/')
+        self.assertEqual((orders[0]['seller_name'], [item['product_name'] for item in orders[0]['items']]),
+                         ("seller", ["Phone", "Phone"]))
+
+        for i in range(1, 4):
+            self.sell([self.imei(2, i), self.imei(0, i), self.imei(1, i)])
+        self.assertEqual(self.list_queries('/api/v1/cashorder/')[0], queries)
+
+    def test_return_list(self):
+        self.sell([self.imei(0, 0)])
+        self.return_order()
+        queries, returns = self.list_queries('/api/v1/return-cashorder/')
+        self.assertEqual(returns[0]['cashorder_detail'][0]['items'][0]['product_name'], "Phone")
+
+        for i in range(1, 4):
+            self.sell([self.imei(1, i), self.imei(2, i)])
+            self.return_order()
+        self.assertEqual(self.list_queries('/api/v1/return-cashorder/')[0], queries)
+
+
+class StockListTests(InventoryTestCase):
+    def test_stock_list(self):
+        queries, lots = self.list_queries('/api/v1/products-stock/')
+        self.assertEqual([(lot['name'], lot['vendor']['name'], len(lot['imei_or_serial_number'])) for lot in lots],
+                         [("Phone", "Vendor", 10)] * 3)
+
+        vendor = Vendor.objects.create(name="Other vendor")
+        for i in range(3):
+            ProductStockIn.objects.create(product=Product.objects.create(name="Tablet {}".format(i)), vendor=vendor,
+                                          purchasing_price=50, available_stock=0)
+        self.assertEqual(self.list_queries('/api/v1/products-stock/')[0], queries)
+
+    def test_claim_list(self):
+        Claim.objects.create(product_stock=self.lots[0], imei_or_serial_number_id=self.imei(0, 0), reason="Screen")
+        queries, claims = self.list_queries('/api/v1/claim/')
+        self.assertEqual((claims[0]['product_name'], claims[0]['vendor_name']), ("Phone", "Vendor"))
+
+        for lot_number in (1, 2):
+            Claim.objects.create(product_stock=self.lots[lot_number],
+                                 imei_or_serial_number_id=self.imei(lot_number, 0), reason="Screen")
+        self.assertEqual(self.list_queries('/api/v1/claim/')[0], queries)
+
+    def test_credit_list(self):
+        self.client.post('/api/v1/credit/', {'payment_status': "PENDING", 'items': [
+            {'imei_or_serial_number': self.imei(0, 0), 'price': 150}]}, format='json')
+        queries, credits = self.list_queries('/api/v1/credit/')
+        self.assertEqual(credits[0]['items'][0]['product_name'], "Phone")
+
+        for i in range(1, 4):
+            self.client.post('/api/v1/credit/', {'payment_status': "PENDING", 'items': [
+                {'imei_or_serial_number': self.imei(1, i), 'price': 150},
+                {'imei_or_serial_number': self.imei(2, i), 'price': 150}]}, format='json')
+        self.assertEqual(self.list_queries('/api/v1/credit/')[0], queries)
+
+
+class CashOrderExportTests(InventoryTestCase):
+    def test_export(self):
+        self.sell([self.imei(0, 0), self.imei(1, 0)])
+        response = self.client.get('/api/v1/export/cashorder/', {'start': '2000-01-01', 'end': '2100-01-01'})
+        self.assertEqual(response.status_code, 200)
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(rows[-2:], ["Total Business,Total Profit", "300,99"])
+
+    def test_bad_date_is_rejected_before_streaming(self):
+        response = self.client.get('/api/v1/export/cashorder/', {'start': 'yesterday', 'end': '2100-01-01'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.streaming)
+
+
+class ReturnCashOrderExportTests(InventoryTestCase):
+    def test_export(self):
+        self.sell([self.imei(0, 0), self.imei(1, 0)])
+        self.client.post('/api/v1/return-cashorder/', {'cash_order': CashOrder.objects.get().id,
+                                                       'reason': "NOT_INTERESTED"}, format='json')
+        response = self.client.get('/api/v1/export/return-cashorder/', {'start': '2000-01-01', 'end': '2100-01-01'})
+        self.assertEqual(response.status_code, 200)
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(rows[-2:], ["Total Amount Returned", "201"])
+
+    def test_bad_date_is_rejected_before_streaming(self):
+        response = self.client.get('/api/v1/export/return-cashorder/', {'start': '2000-01-01', 'end': '2100-13-45'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.streaming)
+
+
+class InvoiceTests(InventoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sell([self.imei(0, 0), self.imei(1, 0)])
+        self.cash_order = CashOrder.objects.get()
+
+    def invoice(self):
+        return self.client.get('/api/v1/export/cashorder/invoice/{}'.format(self.cash_order.unique_id))
+
+    def test_invoice_is_rendered_once_per_order_version(self):
+        with mock.patch('project.apps.inventory.utils.render_pdf', wraps=render_pdf) as render:
+            response = self.invoice()
+            self.assertEqual(response['Content-Type'], "application/pdf")
+            self.assertTrue(response.content.startswith(b"%PDF"))
+            self.assertEqual(self.invoice().content, response.content)
+            self.assertEqual(render.call_count, 1)
+
+            self.cash_order.save()
+            self.invoice()
+            self.assertEqual(render.call_count, 2)
+
+    def test_failed_render_is_not_cached(self):
+        with mock.patch('project.apps.inventory.utils.render_pdf', return_value=None) as render:
+            self.invoice()
+            self.invoice()
+        self.assertEqual(render.call_count, 2)
+
+
+class InvoiceExportTests(InventoryTestCase):
+    def test_failed_renders_are_reported(self):
+        self.sell([self.imei(0, 0)])
+        self.sell([self.imei(0, 1)])
+        first, second = CashOrder.objects.order_by('id')
+        pool = mock.Mock()
+        pool.map.return_value = [b"%PDF", None]
+        with mock.patch('project.apps.inventory.utils.invoice_pool', return_value=pool):
+            response = self.client.get('/api/v1/export/cashorder/invoices/',
+                                       {'unique_id': [first.unique_id, second.unique_id]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Failed-Invoices'], second.unique_id)
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ["invoice-{}.pdf".format(first.unique_id)])
+
+    def test_date_range(self):
+        self.sell([self.imei(0, 0)])
+        with mock.patch('project.apps.inventory.utils.invoice_pool', return_value=mock.Mock()) as pool:
+            pool.return_value.map.return_value = [b"%PDF"]
+            response = self.client.get('/api/v1/export/cashorder/invoices/', {'start': '2000-01-01',
+                                                                              'end': '2100-01-01'})
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ["invoice-{}.pdf".format(CashOrder.objects.get().unique_id)])
+
+    def test_bad_date_is_rejected(self):
+        for params in [{'start': 'yesterday', 'end': '2100-01-01'}, {'start': '2000-01-01'}, {}]:
+            response = self.client.get('/api/v1/export/cashorder/invoices/', params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+class StockGenerationTests(InventoryTestCase):
+    """ Outside an atomic block on_commit callbacks run at once, so the bump must follow the UPDATE. """
+
+    def test_bump_follows_status_update(self):
+        seen = []
+        bump = mock.Mock(side_effect=lambda: seen.append(IMEINumber.objects.get(number=self.imei(0, 0)).status))
+        with mock.patch('project.apps.inventory.models.bump_stock_generation', bump), \
+                mock.patch('django.db.transaction.on_commit', lambda func: func()):
+            IMEINumber.objects.filter(number=self.imei(0, 0)).set_status("ON_CLAIM")
+        self.assertEqual(seen, ["ON_CLAIM"])
+
+    def test_bump_follows_stock_move(self):
+        seen = []
+        bump = mock.Mock(side_effect=lambda: seen.append(self.lot(0).available_stock))
+        with mock.patch('project.apps.inventory.models.bump_stock_generation', bump), \
+                mock.patch('django.db.transaction.on_commit', lambda func: func()):
+            ProductStockIn.objects.filter(id=self.lots[0].id).move_stock(available_stock=-1, on_credit=1)
+        self.assertEqual(seen, [9])
+
+
+class SellerShareUpdateTests(InventoryTestCase):
+    def update_shares(self, seller_share, business_share):
+        return self.client.put('/api/v1/seller-profile/{}/'.format(self.seller.id), {
+            'id': self.seller.id, 'username': "seller", 'seller_share': seller_share, 'business_share': business_share,
+        }, format='json')
+
+    def test_profit_is_recomputed_from_all_sales(self):
+        self.sell([self.imei(0, 0), self.imei(1, 0)])
+        self.sell([self.imei(2, 0)], price=200)
+        # 50 + 49 + 98 = 197 profit: 197 * 20% = 39.4 for the seller, 197 * (70% - 50%) = 39.4 more for the business
+        response = self.update_shares(20, 70)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['profit'], response.data['seller_share'], response.data['business_share']),
+                         (39, 20, 70))
+        company = CompanyProfile.objects.get()
+        self.assertEqual(company.running_business_balance, 49 + 49 + 39)
+
+    def test_query_count_does_not_grow_with_sales(self):
+        self.sell([self.imei(0, 0)])
+        get_singleton(CompanyProfile)
+        with CaptureQueriesContext(connection) as one_order:
+            self.update_shares(30, 60)
+        for i in range(1, 5):
+            self.sell([self.imei(0, i), self.imei(1, i), self.imei(2, i)])
+        with CaptureQueriesContext(connection) as five_orders:
+            self.update_shares(40, 50)
+        self.assertEqual(len(five_orders), len(one_order))
+
+    def test_bad_share_is_rejected(self):
+        self.assertEqual(self.update_shares("forty", 50).status_code, 400)
+        self.assertEqual(SellerProfile.objects.get().seller_share, 40)
+        self.assertFalse(BalanceEntry.objects.exists())
+
+
+class SoldImeiFilterTests(InventoryTestCase):
+    def setUp(self):
+        super().setUp()
+        caching._sold_imeis_mirror.update(generation=None, bits=None)
+
+    def check(self, number):
+        return self.client.post('/api/v1/check-valid-imei/', {'imei_or_serial_number': number}, format='json').data
+
+    def test_unsold_imei_is_answered_from_the_filter(self):
+        self.sell([self.imei(0, 0)])
+        self.assertEqual(self.check(self.imei(0, 1)), "True")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.check(self.imei(0, 2)), "True")
+        self.assertEqual(self.check(self.imei(0, 0)), "False")
+
+    def test_sales_are_added_without_a_rebuild(self):
+        self.check(self.imei(0, 1))
+        self.sell([self.imei(0, 0), self.imei(1, 0)])
+        self.assertTrue(caching.might_be_sold(self.imei(1, 0)))
+        with self.assertNumQueries(0):
+            self.assertTrue(caching.might_be_sold(self.imei(0, 0)))
+            self.assertFalse(caching.might_be_sold(self.imei(2, 0)))
+
+    def test_sale_without_a_cached_predecessor_is_rebuilt(self):
+        self.check(self.imei(2, 0))
+        self.sell([self.imei(0, 0)])
+        cache.delete(caching._sold_imeis_key(cache.get(caching.SOLD_IMEIS_GENERATION_KEY)))
+        self.sell([self.imei(1, 0)])
+        self.assertIsNone(cache.get(caching._sold_imeis_key(cache.get(caching.SOLD_IMEIS_GENERATION_KEY))))
+        self.assertEqual((self.check(self.imei(0, 0)), self.check(self.imei(1, 0))), ("False", "False"))
+
+    def test_deleted_sale_is_retired(self):
+        self.sell([self.imei(0, 0)])
+        self.assertEqual(self.check(self.imei(0, 0)), "False")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/api/v1/cashorder/{}/'.format(CashOrder.objects.get().id))
+        self.assertFalse(caching.might_be_sold(self.imei(0, 0)))
+        self.assertEqual(self.check(self.imei(0, 0)), "True")
+
+
+class IMEIStatusTests(InventoryTestCase):
+    def status(self, number):
+        return IMEINumber.objects.get(number=number).status
+
+    def available(self):
+        response = self.client.get('/api/v1/available-imei/', {'product': self.product.id})
+        return response.data['available_imeis']
+
+    def test_available_follows_status(self):
+        self.assertEqual(len(self.available()), 30)
+        self.sell([self.imei(0, 0), self.imei(0, 1)])
+        self.client.post('/api/v1/return-cashorder/', {'cash_order': CashOrder.objects.get().id,
+                                                       'reason': "NOT_INTERESTED"}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/credit/', {'payment_status': "PENDING", 'items': [
+                {'imei_or_serial_number': self.imei(1, 0), 'price': 150}]}, format='json')
+            Claim.objects.create(product_stock=self.lots[2], imei_or_serial_number_id=self.imei(2, 0), reason="Screen")
+
+        available = self.available()
+        self.assertEqual(available, sorted(available))
+        self.assertIn(self.imei(0, 0), available)
+        self.assertNotIn(self.imei(1, 0), available)
+        self.assertNotIn(self.imei(2, 0), available)
+        self.assertEqual(len(available), 28)
+
+    def test_returned_imei_can_be_sold_again(self):
+        self.sell([self.imei(0, 0)])
+        self.client.post('/api/v1/return-cashorder/', {'cash_order': CashOrder.objects.get().id,
+                                                       'reason': "ISSUE"}, format='json')
+        self.assertEqual(self.status(self.imei(0, 0)), "RETURNED")
+        self.assertEqual(self.sell([self.imei(0, 0)]).status_code, 200)
+        self.assertEqual(self.status(self.imei(0, 0)), "SOLD")
+
+    def test_undoing_moves_back_to_stock(self):
+        self.sell([self.imei(0, 0)])
+        response = self.client.post('/api/v1/credit/', {'payment_status': "PENDING", 'items': [
+            {'imei_or_serial_number': self.imei(1, 0), 'price': 150}]}, format='json')
+        self.client.put('/api/v1/credit/{}/'.format(response.data['id']), {'payment_status': "CLEARED"}, format='json')
+        self.assertEqual((self.status(self.imei(0, 0)), self.status(self.imei(1, 0))), ("SOLD", "SOLD"))
+
+        self.client.delete('/api/v1/cashorder/{}/'.format(CashOrder.objects.get().id))
+        self.client.delete('/api/v1/credit/{}/'.format(response.data['id']))
+        self.assertEqual((self.status(self.imei(0, 0)), self.status(self.imei(1, 0))), ("IN_STOCK", "IN_STOCK"))
+
+    def test_status_is_listed(self):
+        response = self.client.get('/api/v1/imei-numbers/', {'search': self.imei(0, 0)})
+        self.assertEqual(response.data['results'], [{'number': self.imei(0, 0), 'status': "IN_STOCK"}])
+
+
+class SingletonCacheTests(InventoryTestCase):
+    def setUp(self):
+        super().setUp()
+        caching._singletons.clear()
+
+    def test_served_from_memory(self):
+        setting, company = get_singleton(Setting), get_singleton(CompanyProfile)
+        with self.assertNumQueries(0):
+            self.assertIs(get_singleton(Setting), setting)
+            self.assertIs(get_singleton(CompanyProfile), company)
+
+    def test_saves_are_picked_up(self):
+        get_singleton(Setting), get_singleton(CompanyProfile)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/v1/settings/{}/'.format(Setting.objects.get().id), {'owner_share': 20},
+                                         format='json')
+        self.assertEqual(response.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch('/api/v1/company-profile/{}/'.format(self.company.id), {'owner_name': "New owner"},
+                              format='json')
+        self.assertEqual(get_singleton(Setting).owner_share, 20)
+        self.assertEqual(get_singleton(CompanyProfile).owner_name, "New owner")
+
+        # 50 profit at the new 20% owner share
+        self.sell([self.imei(0, 0)])
+        self.assertEqual(Transaction.objects.get().owner_profit, 10)
+
+    def test_delete_is_picked_up(self):
+        get_singleton(CompanyProfile)
+        with self.captureOnCommitCallbacks(execute=True):
+            CompanyProfile.objects.create(owner_name="Second")
+            self.company.delete()
+        self.assertEqual(get_singleton(CompanyProfile).owner_name, "Second")
+
+    def test_uncommitted_save_is_not_published(self):
+        setting = get_singleton(Setting)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            Setting.objects.filter(id=setting.id).update(owner_share=30)
+            Setting.objects.get().save()
+        self.assertEqual(len(callbacks), 1)
+        self.assertIs(get_singleton(Setting), setting)
+
+
+class CheckValidImeisTests(InventoryTestCase):
+    def statuses(self, data, format='json'):
+        return self.client.post('/api/v1/check-valid-imeis/', data, format=format)
+
+    def test_each_status(self):
+        self.sell([self.imei(0, 0)])
+        self.sell([self.imei(0, 1)])
+        self.client.post('/api/v1/return-cashorder/', {'cash_order': CashOrder.objects.latest('id').id,
+                                                       'reason': "NOT_INTERESTED"}, format='json')
+        self.client.post('/api/v1/credit/', {'payment_status': "PENDING", 'items': [
+            {'imei_or_serial_number': self.imei(1, 0), 'price': 150}]}, format='json')
+        self.client.post('/api/v1/claim/', {'product_stock': self.lots[2].id, 'reason': "Screen",
+                                            'imei_or_serial_number': self.imei(2, 0)}, format='json')
+        numbers = [self.imei(0, 0), self.imei(0, 1), self.imei(1, 0), self.imei(2, 0), self.imei(2, 1),
+                   "999999999999999"]
+
+        response = self.statuses({'imei_or_serial_numbers': numbers})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, dict(zip(numbers, ["sold", "returned", "on_credit", "on_claim",
+                                                           "in_stock", "unknown"])))
+
+    def test_form_data_list(self):
+        response = self.statuses({'imei_or_serial_numbers': [self.imei(0, 0), self.imei(0, 1)]}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {self.imei(0, 0): "in_stock", self.imei(0, 1): "in_stock"})
+
+    def test_json_numbers(self):
+        response = self.statuses({'imei_or_serial_numbers': [int(self.imei(1, 1))]})
+        self.assertEqual(response.data, {self.imei(1, 1): "in_stock"})
+
+    def test_bad_input_is_rejected(self):
+        for data in [{}, {'imei_or_serial_numbers': []}, {'imei_or_serial_numbers': self.imei(0, 0)}]:
+            self.assertEqual(self.statuses(data).status_code, 400, data)
+
+
+class BalanceLedgerTests(InventoryTestCase):
+    """
+    Two phones sold at 150 from the 100 and 101 lots make 99 profit: 39 to the seller (40%),
+    9 to the owner (10%) and 49 to the business (50%), each truncated to whole rupees.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.sell([self.imei(0, 0), self.imei(1, 0)])
+        self.cash_order = CashOrder.objects.get()
+
+    def balances(self):
+        seller = SellerProfile.objects.get(id=self.seller.id)
+        company = CompanyProfile.objects.get(id=self.company.id)
+        return seller.running_profit, company.running_owner_balance, company.running_business_balance
+
+    def api_balances(self):
+        seller = self.client.get('/api/v1/seller-profile/{}/'.format(self.seller.id)).data
+        company = self.client.get('/api/v1/company-profile/{}/'.format(self.company.id)).data
+        return seller['profit'], company['owner_balance'], company['business_balance']
+
+    def return_order(self, reason, **data):
+        response = self.client.post('/api/v1/return-cashorder/', dict(cash_order=self.cash_order.id, reason=reason,
+                                                                      **data), format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def week_closure_rows(self, **params):
+        response = self.client.get('/api/v1/export/week-closure/', params)
+        return [row.split(",") for row in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_sale(self):
+        entries = BalanceEntry.objects.filter(compacted=False).order_by('account')
+        self.assertEqual([(entry.account, entry.amount) for entry in entries],
+                         [("BUSINESS", 49), ("OWNER", 9), ("SELLER", 39)])
+        self.assertEqual(self.balances(), (39, 9, 49))
+        self.assertEqual(self.api_balances(), (39, 9, 49))
+
+    def test_return_not_interested(self):
+        self.return_order("NOT_INTERESTED")
+        self.assertEqual(BalanceEntry.objects.count(), 3)
+        self.assertEqual(self.balances(), (39, 9, 49))
+
+    def test_return_issue(self):
+        # the seller share of the order profit is taken back: -(99 * 40%) = -39.6, truncated to -39
+        self.return_order("ISSUE")
+        self.assertEqual(self.balances(), (0, 9, 49))
+
+    def test_return_custom(self):
+        # 300 sold, 250 refunded leaves 50 profit: 50 * 40% - 99 * 40% = 20 - 39.6 = -19.6, truncated to -19
+        self.return_order("CUSTOM", return_amount=250, reason_description="Scratched")
+        self.assertEqual(self.balances(), (20, 9, 49))
+
+    def test_order_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/v1/cashorder/{}/'.format(self.cash_order.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.balances(), (0, 0, 0))
+
+    def test_share_update(self):
+        # rebased on 30%: 99 * 30% = 29.7, truncated to 29; the business gains 99 * (60% - 50%) = 9.9, truncated to 9
+        response = self.client.put('/api/v1/seller-profile/{}/'.format(self.seller.id), {
+            'id': self.seller.id, 'username': "seller", 'seller_share': 30, 'business_share': 60,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['profit'], 29)
+        self.assertEqual(self.balances(), (29, 9, 58))
+
+    def test_compaction_twice(self):
+        out = StringIO()
+        call_command('compact_balances', stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Compacted 3 balance entries")
+        seller = SellerProfile.objects.get(id=self.seller.id)
+        company = CompanyProfile.objects.get(id=self.company.id)
+        self.assertEqual((seller.profit, company.owner_balance, company.business_balance), (39, 9, 49))
+        self.assertFalse(BalanceEntry.objects.filter(compacted=False).exists())
+
+        self.assertEqual(BalanceEntry.objects.compact(), 0)
+        seller = SellerProfile.objects.get(id=self.seller.id)
+        company = CompanyProfile.objects.get(id=self.company.id)
+        self.assertEqual((seller.profit, company.owner_balance, company.business_balance), (39, 9, 49))
+        self.assertEqual(self.balances(), (39, 9, 49))
+
+    def test_closure(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/week-closure/')
+        self.assertEqual(response.status_code, 205)
+        week_closure = WeekClosure.objects.get()
+        self.assertEqual((week_closure.total_profit, week_closure.business_profit), (39, 49))
+
+        # the owner balance is not part of the closure
+        self.assertEqual(self.api_balances(), (0, 9, 0))
+        self.assertEqual(self.week_closure_rows()[-1], ["PKR 0", "PKR 0"])
+
+        self.sell([self.imei(2, 0)])
+        # 150 - 102 = 48 profit: 19.2, 4.8 and 24 truncated
+        self.assertEqual(self.api_balances(), (19, 13, 24))
+
+    def test_closure_export(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/week-closure/')
+        self.sell([self.imei(2, 0)])
+
+        rows = self.week_closure_rows(closure=WeekClosure.objects.get().id)
+        self.assertEqual(rows[1][:4], ["seller", "39", "40", "50"])
+        self.assertEqual(rows[-1], ["PKR 39", "PKR 49"])
+
+
+class ApproximateCountTests(InventoryTestCase):
+    plan = [{"Plan": {"Node Type": "Seq Scan", "Relation Name": "inventory_productstockin",
+                      "Startup Cost": 0.00, "Total Cost": 18.30, "Plan Rows": 830, "Plan Width": 4}}]
+
+    def test_plan_rows(self):
+        self.assertEqual(plan_rows(self.plan), 830)
+        self.assertEqual(plan_rows(json.dumps(self.plan)), 830)
+
+    def test_count_param(self):
+        response = self.client.get('/api/v1/products-stock/', {'pagination': 'cursor', 'count': 'approximate'})
+        self.assertEqual(response.status_code, 200)
+        if connection.vendor != 'postgresql':
+            self.assertEqual(response.data['count'], 3)
+        self.assertIsInstance(response.data['count'], int)
+
+
+class RoutedSearchTests(InventoryTestCase):
+    def setUp(self):
+        super().setUp()
+        IMEINumber.objects.bulk_create([IMEINumber(number=number) for number in ["SN12AB", "4471", "SN-0001-X"]])
+        self.lots[2].imei_or_serial_number.add("SN12AB", "4471", "SN-0001-X")
+        self.sell([self.imei(0, 0)])
+        CashOrder.objects.update(unique_id="AB12CD")
+        self.cash_order = CashOrder.objects.get()
+        self.other_seller = SellerProfile.objects.create(username="imran", business_share=50, seller_share=40)
+
+    def search(self, url, term):
+        response = self.client.get(url, {'search': term})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def search_stock(self, term):
+        return self.search('/api/v1/products-stock/', term)
+
+    def search_orders(self, term):
+        return self.search('/api/v1/cashorder/', term)
+
+    def test_stock_imei(self):
+        self.assertEqual(self.search_stock(self.imei(1, 3)), [self.lots[1].id])
+
+    def test_stock_number(self):
+        self.assertEqual(self.search_stock(str(self.lots[0].id)), [self.lots[0].id])
+        self.assertEqual(self.search_stock("4471"), [self.lots[2].id])
+
+    def test_stock_code(self):
+        self.assertEqual(self.search_stock("SN12AB"), [self.lots[2].id])
+        self.assertEqual(self.search_stock("vendor"), [lot.id for lot in reversed(self.lots)])
+
+    def test_stock_text(self):
+        self.assertEqual(self.search_stock("SN-0001-X"), [self.lots[2].id])
+        self.assertEqual(self.search_stock("phon"), [lot.id for lot in reversed(self.lots)])
+        self.assertEqual(self.search_stock("Tablet"), [])
+
+    def test_order_imei(self):
+        self.assertEqual(self.search_orders(self.imei(0, 0)), [self.cash_order.id])
+        self.assertEqual(self.search_orders(self.imei(0, 1)), [])
+
+    def test_order_code(self):
+        self.assertEqual(self.search_orders(self.cash_order.unique_id), [self.cash_order.id])
+        self.assertEqual(self.search_orders(self.cash_order.unique_id.lower()), [self.cash_order.id])
+        self.assertEqual(self.search_orders("SELLER"), [self.cash_order.id])
+
+    def test_order_number(self):
+        self.assertEqual(self.search_orders(str(self.cash_order.id)), [self.cash_order.id])
+
+    def test_order_date(self):
+        today = timezone.localdate()
+        self.assertEqual(self.search_orders(today.isoformat()), [self.cash_order.id])
+        self.assertEqual(self.search_orders(today.strftime("%Y-%m")), [self.cash_order.id])
+        self.assertEqual(self.search_orders("2000-01-01"), [])
+
+    def test_order_text(self):
+        self.assertEqual(self.search_orders("sell"), [self.cash_order.id])
+        self.assertEqual(self.search_orders("imran"), [])
+
+
+class StockInTests(InventoryTestCase):
+    def delivery(self, *lots, price=90):
+        return [{'product': self.product.id, 'vendor': self.vendor.id, 'purchasing_price': price,
+                 'available_stock': len(numbers), 'imei_or_serial_number': numbers} for numbers in lots]
+
+    def stock_in(self, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/v1/products-stock/', data, format='json')
+
+    def numbers(self, lot_number, count):
+        return [self.imei(lot_number, i) for i in range(count)]
+
+    def test_multiple_lots(self):
+        IMEINumber.objects.create(number=self.imei(3, 0))
+        response = self.stock_in(self.delivery(self.numbers(3, 3), self.numbers(4, 2)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([len(lot['imei_or_serial_number']) for lot in response.data], [3, 2])
+
+        for lot, lot_number, count in zip(response.data, [3, 4], [3, 2]):
+            stocked = ProductStockIn.objects.get(id=lot['id'])
+            self.assertEqual(sorted(stocked.imei_or_serial_number.values_list('number', flat=True)),
+                             self.numbers(lot_number, count))
+            self.assertEqual(list(stocked.imei_numbers.values_list('status', flat=True).distinct()), ["IN_STOCK"])
+            self.assertEqual((stocked.available_stock, stocked.asset), (count, 90 * count))
+
+    def test_single_lot(self):
+        response = self.stock_in(self.delivery(self.numbers(3, 2))[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.data, dict)
+        self.assertEqual((response.data['name'], response.data['vendor']['name']), ("Phone", "Vendor"))
+        self.assertEqual(sorted(response.data['imei_or_serial_number']), self.numbers(3, 2))
+
+    def test_repeated_imei_rejects_delivery(self):
+        response = self.stock_in(self.delivery(self.numbers(3, 2), [self.imei(4, 0), self.imei(3, 1)]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(ProductStockIn.objects.count(), 3)
+        self.assertFalse(IMEINumber.objects.filter(number__startswith="3").exists())
+
+    def test_held_imei_rejects_delivery(self):
+        response = self.stock_in(self.delivery(self.numbers(3, 2), [self.imei(4, 0), self.imei(0, 5)]))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(self.imei(0, 5), response.data)
+        self.assertEqual(ProductStockIn.objects.count(), 3)
+        self.assertFalse(IMEINumber.objects.filter(number__startswith="3").exists())
+        self.assertFalse(IMEINumber.objects.filter(number=self.imei(4, 0)).exists())
+        self.assertEqual(IMEINumber.objects.get(number=self.imei(0, 5)).product_stock_id, self.lots[0].id)
+
+    def test_query_count(self):
+        # the query count depends on the number of lots, not of IMEIs; the larger delivery stays within
+        # a single SQLite bulk insert batch
+        with self.assertNumQueries(13):
+            self.stock_in(self.delivery(self.numbers(3, 2), self.numbers(4, 2)))
+        with self.assertNumQueries(13):
+            self.stock_in(self.delivery(self.numbers(5, 90), self.numbers(6, 90)))
+
+
+class WeekClosureTestCase(InventoryTestCase):
+    """
+    The seller sells a 100 phone for 150 (50 profit: 20 seller, 5 owner, 25 business) and a second seller
+    on a 30% share sells a 101 phone for 201 (100 profit: 30 seller, 10 owner, 50 business).
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.other_seller = SellerProfile.objects.create(username="imran", business_share=50, seller_share=30)
+        self.sell([self.imei(0, 0)])
+        self.sell_by(self.other_seller, self.imei(1, 0), 201)
+
+    def sell_by(self, seller, number, price):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/cashorder/', {
+                'sale_by': seller.id, 'customer_name': "Customer", 'warranty': 0,
+                'items': [{'imei_or_serial_number': number, 'price': price}],
+            }, format='json')
+
+    def close_week(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/week-closure/')
+        self.assertEqual(response.status_code, 205)
+        return WeekClosure.objects.latest('id')
+
+    def seller_balances(self):
+        return {seller['username']: seller['profit']
+                for seller in self.client.get('/api/v1/seller-profile/').data['results']}
+
+    def business_balance(self):
+        return self.client.get('/api/v1/company-profile/{}/'.format(self.company.id)).data['business_balance']
+
+
+class WeekClosureTests(WeekClosureTestCase):
+    def test_closure_snapshots_totals_and_resets_balances(self):
+        self.assertEqual(self.seller_balances(), {"seller": 20, "imran": 30})
+        self.assertEqual(self.business_balance(), 75)
+
+        week_closure = self.close_week()
+        self.assertEqual((week_closure.total_profit, week_closure.business_profit), (50, 75))
+        self.assertEqual(self.seller_balances(), {"seller": 0, "imran": 0})
+        self.assertEqual(self.business_balance(), 0)
+
+        response = self.client.get('/api/v1/week-closure/')
+        self.assertEqual([(closure['total_profit'], closure['business_profit']) for closure in response.data],
+                         [(50, 75)])
+
+    def test_empty_week(self):
+        self.close_week()
+        week_closure = self.close_week()
+        self.assertEqual((week_closure.total_profit, week_closure.business_profit), (0, 0))
+        self.assertEqual(self.seller_balances(), {"seller": 0, "imran": 0})
+        self.assertEqual(SellerProfile.objects.get(id=self.seller.id).running_profit, 20)
+
+    def test_seller_snapshots(self):
+        first = self.close_week()
+        self.sell([self.imei(0, 1)])
+        response = self.client.put('/api/v1/seller-profile/{}/'.format(self.other_seller.id), {
+            'id': self.other_seller.id, 'username': "imran", 'seller_share': 35, 'business_share': 45,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        # the share update rebases imran on 35% of 100 profit, 5 more than the 30 already closed
+        self.assertEqual(self.seller_balances(), {"seller": 20, "imran": 5})
+        second = self.close_week()
+
+        snapshots = SellerClosure.objects.order_by('week_closure', 'seller').values_list(
+            'week_closure', 'seller__username', 'profit', 'closing_profit', 'seller_share', 'business_share')
+        self.assertEqual(list(snapshots), [
+            (first.id, "seller", 20, 20, 40, 50), (first.id, "imran", 30, 30, 30, 50),
+            (second.id, "seller", 20, 40, 40, 50), (second.id, "imran", 5, 35, 35, 45),
+        ])
+        self.assertEqual((second.total_profit, second.business_profit), (25, 25 - 5))
+
+        response = self.client.get('/api/v1/week-closure/')
+        self.assertEqual([[(seller['username'], seller['profit']) for seller in closure['sellers']]
+                          for closure in response.data],
+                         [[("seller", 20), ("imran", 30)], [("seller", 20), ("imran", 5)]])
+
+    def test_new_seller_after_closure(self):
+        self.close_week()
+        newcomer = SellerProfile.objects.create(username="sana", business_share=50, seller_share=40)
+        self.sell_by(newcomer, self.imei(2, 0), 152)
+        self.assertEqual(self.seller_balances()["sana"], 20)
+        self.assertEqual(self.close_week().sellers.get(seller=newcomer).closing_profit, 20)
+
+
+class WeekClosureExportTests(WeekClosureTestCase):
+    def export(self, **params):
+        response = self.client.get('/api/v1/export/week-closure/', params)
+        self.assertEqual(response.status_code, 200)
+        return list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+
+    def test_current_week(self):
+        SellerProfile.objects.filter(id=self.other_seller.id).update(username="Khan, Imran")
+        rows = self.export()
+        self.assertEqual(rows[0], ["Name", "Profit", "Seller share", "Business Share", "Updated Date", "Joining Date"])
+        self.assertEqual([row[:4] for row in rows[1:3]],
+                         [["seller", "20", "40", "50"], ["Khan, Imran", "30", "30", "50"]])
+        self.assertEqual(rows[-2:], [["Total Profit", "Business Profit"], ["PKR 50", "PKR 75"]])
+
+    def test_past_closure(self):
+        first = self.close_week()
+        self.sell([self.imei(0, 1)])
+        self.close_week()
+        self.sell([self.imei(0, 2)])
+
+        rows = self.export(closure=first.id)
+        self.assertEqual([row[:2] for row in rows[1:3]], [["seller", "20"], ["imran", "30"]])
+        self.assertEqual(rows[-1], ["PKR 50", "PKR 75"])
+        self.assertEqual(self.export()[-1], ["PKR 20", "PKR 25"])
+
+    def test_unknown_closure(self):
+        response = self.client.get('/api/v1/export/week-closure/', {'closure': 999})
+        self.assertEqual(response.status_code, 404)
+
+    def test_bad_closure(self):
+        for closure in ["last", "1.5", ""]:
+            response = self.client.get('/api/v1/export/week-closure/', {'closure': closure})
+            self.assertEqual(response.status_code, 400, closure)
+
+
+class FilterSetTests(InventoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_seller = SellerProfile.objects.create(username="imran", business_share=50, seller_share=30)
+        self.sell([self.imei(0, 0)])
+        self.sell([self.imei(0, 1)])
+        old, new = CashOrder.objects.order_by('id')
+        self.old_order, self.new_order = old, new
+        CashOrder.objects.filter(id=old.id).update(sale_by=self.other_seller,
+                                                   created_at=timezone.make_aware(datetime.datetime(2020, 1, 15)),
+                                                   updated_at=timezone.make_aware(datetime.datetime(2020, 2, 15)))
+        self.client.post('/api/v1/return-cashorder/', {'cash_order': old.id, 'reason': "NOT_INTERESTED"}, format='json')
+        self.client.post('/api/v1/return-cashorder/', {'cash_order': new.id, 'reason': "ISSUE"}, format='json')
+
+    def ids(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return sorted(row['id'] for row in response.data['results'])
+
+    def assertRejected(self, url, **params):
+        self.assertEqual(self.client.get(url, params).status_code, 400, params)
+
+    def test_cash_orders(self):
+        url = '/api/v1/cashorder/'
+        self.assertEqual(self.ids(url, created_after='2020-01-01', created_before='2020-01-31'), [self.old_order.id])
+        self.assertEqual(self.ids(url, updated_after='2020-02-01', updated_before='2020-02-28'), [self.old_order.id])
+        self.assertEqual(self.ids(url, created_after=timezone.localdate().isoformat()), [self.new_order.id])
+        self.assertEqual(self.ids(url, sale_by=self.seller.id), [self.new_order.id])
+        self.assertEqual(self.ids(url, unique_id=self.old_order.unique_id), [self.old_order.id])
+        self.assertRejected(url, created_after='15/01/2020')
+        self.assertRejected(url, sale_by=999)
+
+    def test_returns(self):
+        url = '/api/v1/return-cashorder/'
+        old, new = ReturnCashOrder.objects.order_by('id')
+        self.assertEqual(self.ids(url, reason="ISSUE"), [new.id])
+        self.assertEqual(self.ids(url, seller=self.other_seller.id), [old.id])
+        self.assertEqual(self.ids(url, cash_order=self.new_order.id), [new.id])
+        self.assertEqual(self.ids(url, created_before='2020-01-01'), [])
+        self.assertRejected(url, reason="BROKEN")
+
+    def test_credits(self):
+        url = '/api/v1/credit/'
+        for number in (self.imei(1, 0), self.imei(1, 1)):
+            self.client.post(url, {'payment_status': "PENDING", 'items': [
+                {'imei_or_serial_number': number, 'price': 150}]}, format='json')
+        pending, cleared = Credit.objects.order_by('id')
+        self.client.put('{}{}/'.format(url, cleared.id), {'payment_status': "CLEARED"}, format='json')
+        Credit.objects.filter(id=pending.id).update(created_at=timezone.make_aware(datetime.datetime(2020, 1, 15)))
+
+        self.assertEqual(self.ids(url, payment_status="CLEARED"), [cleared.id])
+        self.assertEqual(self.ids(url, created_after='2020-01-01', created_before='2020-01-31'), [pending.id])
+        self.assertRejected(url, payment_status="PAID")
+
+    def test_claims(self):
+        url = '/api/v1/claim/'
+        first = Claim.objects.create(product_stock=self.lots[1], imei_or_serial_number_id=self.imei(1, 0),
+                                     reason="Screen")
+        second = Claim.objects.create(product_stock=self.lots[2], imei_or_serial_number_id=self.imei(2, 0),
+                                      reason="Battery")
+        second.status = "CLEARED"
+        second.save()
+
+        self.assertEqual(self.ids(url, status="PENDING"), [first.id])
+        self.assertEqual(self.ids(url, product_stock=self.lots[2].id), [second.id])
+        self.assertEqual(self.ids(url, imei_or_serial_number=self.imei(1, 0)), [first.id])
+        self.assertEqual(self.ids(url, created_after=timezone.localdate().isoformat()), [first.id, second.id])
+        self.assertRejected(url, status="OPEN")
+
+    def test_stock(self):
+        url = '/api/v1/products-stock/'
+        tablet, other_vendor = Product.objects.create(name="Tablet"), Vendor.objects.create(name="Other")
+        lot = ProductStockIn.objects.create(product=tablet, vendor=other_vendor, purchasing_price=50, available_stock=0)
+        ProductStockIn.objects.filter(id=self.lots[0].id).update(
+            created_at=timezone.make_aware(datetime.datetime(2020, 1, 15)))
 
-# Create your tests here.
+        self.assertEqual(self.ids(url, product=tablet.id), [lot.id])
+        self.assertEqual(self.ids(url, vendor=self.vendor.id), [self.lots[0].id, self.lots[1].id, self.lots[2].id])
+        self.assertEqual(self.ids(url, created_before='2020-12-31'), [self.lots[0].id])
+        self.assertRejected(url, vendor="other")
@@ -22,8 +22,10 @@ urlpatterns = [
     path('export/cashorder/', ExportCashOrderViews.as_view()),
     path('export/return-cashorder/', ExportReturnCashOrderViews.as_view()),
     path('export/cashorder/invoice/<str:unique_id>', GenerateOrderInvoice.as_view()),
+    path('export/cashorder/invoices/', ExportOrderInvoices.as_view()),
     path('available-imei/', AvailableImeiViews.as_view()),
     path("export/week-closure/", ExportWeekClosureView.as_view()),
     path("week-closure/", WeekClosureViews.as_view()),
     path("check-valid-imei/", check_valid_imei),
+    path("check-valid-imeis/", check_valid_imeis),
 ] + router.urls
@@ -1,16 +1,168 @@
+import csv
+import logging
+import multiprocessing
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
-from django.http import HttpResponse
-from django.template.loader import get_template
+from tempfile import SpooledTemporaryFile
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template.loader import get_template, render_to_string
+from django.utils import timezone
 from xhtml2pdf import pisa
 
+logger = logging.getLogger(__name__)
+
+
+def render_pdf(html):
+    """ Converts rendered html to PDF bytes in memory, returning None if xhtml2pdf reports errors. """
+    result = BytesIO()
+    pdf = pisa.pisaDocument(BytesIO(html.encode("ISO-8859-1")), result)
+    if not pdf.err:
+        return result.getvalue()
+    return None
+
 
 def html_to_pdf(template_src, context_dict=None):
     if context_dict is None:
         context_dict = {}
     template = get_template(template_src)
-    html = template.render(context_dict)
-    result = BytesIO()
-    pdf = pisa.pisaDocument(BytesIO(html.encode("ISO-8859-1")), result)
-    if not pdf.err:
-        return HttpResponse(result.getvalue(), content_type="application/pdf")
+    pdf = render_pdf(template.render(context_dict))
+    if pdf is not None:
+        return HttpResponse(pdf, content_type="application/pdf")
     return None
+
+
+def invoice_cache_key(cash_order):
+    # cash orders can't be updated through the API, so id and updated_at identify the invoice content
+    return "invoice:{}:{}".format(cash_order.id, cash_order.updated_at.timestamp())
+
+
+def render_invoice_html(cash_order):
+    # expects cashorderitem_set to be prefetched with product_stock__product
+    return render_to_string("inventory/company_invoice.html",
+                            {'cash_order': cash_order, 'cash_order_items': cash_order.cashorderitem_set.all()})
+
+
+def invoice_pdf(cash_order):
+    """ Returns the invoice PDF bytes for the order, rendering it only on a cache miss. """
+    key = invoice_cache_key(cash_order)
+    pdf = cache.get(key)
+    if pdf is None:
+        pdf = render_pdf(render_invoice_html(cash_order))
+        if pdf is not None:
+            cache.set(key, pdf, timeout=None)
+    return pdf
+
+
+INVOICE_RENDER_PROCESSES = 2
+
+_invoice_pool = None
+_invoice_pool_lock = threading.Lock()
+
+
+def invoice_pool():
+    """
+    Returns the process pool shared by every invoice batch in this worker, so concurrent batches queue
+    for the same INVOICE_RENDER_PROCESSES spawned renderers instead of starting their own.
+    """
+    global _invoice_pool
+    with _invoice_pool_lock:
+        if _invoice_pool is None:
+            _invoice_pool = ProcessPoolExecutor(max_workers=INVOICE_RENDER_PROCESSES,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return _invoice_pool
+
+
+def _discard_invoice_pool(pool):
+    global _invoice_pool
+    with _invoice_pool_lock:
+        if _invoice_pool is pool:
+            _invoice_pool = None
+    pool.shutdown(wait=False)
+
+
+def invoices_zip(cash_orders, chunk_size=50):
+    """
+    Writes the invoice PDFs of the orders into a ZIP file and returns it rewound, with the unique_ids
+    of the orders whose invoice could not be rendered. Cached invoices are reused; the rest are
+    rendered by the shared pool, whose processes only run xhtml2pdf and never touch the database.
+    """
+    archive = SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    failed = []
+    pool = invoice_pool()
+    try:
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            chunk = []
+            for cash_order in queryset_in_chunks(cash_orders, chunk_size):
+                chunk.append(cash_order)
+                if len(chunk) == chunk_size:
+                    failed += _write_invoices(zip_file, pool, chunk)
+                    chunk = []
+            failed += _write_invoices(zip_file, pool, chunk)
+    except BrokenProcessPool:
+        _discard_invoice_pool(pool)
+        raise
+    if failed:
+        logger.warning("Invoices could not be rendered: %s", ", ".join(failed))
+    archive.seek(0)
+    return archive, failed
+
+
+def _write_invoices(zip_file, pool, cash_orders):
+    keys = {cash_order.id: invoice_cache_key(cash_order) for cash_order in cash_orders}
+    pdfs = cache.get_many(keys.values())
+    missing = [cash_order for cash_order in cash_orders if keys[cash_order.id] not in pdfs]
+    rendered = pool.map(render_pdf, [render_invoice_html(cash_order) for cash_order in missing])
+    for cash_order, pdf in zip(missing, rendered):
+        if pdf is not None:
+            pdfs[keys[cash_order.id]] = pdf
+            cache.set(keys[cash_order.id], pdf, timeout=None)
+
+    failed = []
+    for cash_order in cash_orders:
+        if keys[cash_order.id] in pdfs:
+            zip_file.writestr("invoice-{}.pdf".format(cash_order.unique_id), pdfs[keys[cash_order.id]])
+        else:
+            failed.append(cash_order.unique_id)
+    return failed
+
+
+class Echo:
+    """ File-like object handing back whatever is written, so csv rows can be streamed. """
+
+    def write(self, value):
+        return value
+
+
+def queryset_in_chunks(queryset, chunk_size=500):
+    """ Yields objects in primary key order, fetching (and prefetching) one chunk per query. """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        last_pk = chunk[-1].pk
+
+
+def stream_csv(rows, filename):
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
+
+
+def date_range_params(query_params, field):
+    """
+    Parses ?start and ?end with the model field they filter, so bad input fails before a response is
+    streamed. Returns None when either is missing and raises ValidationError when one does not parse.
+    """
+    if 'start' not in query_params or 'end' not in query_params:
+        return None
+    bounds = [field.to_python(query_params['start']), field.to_python(query_params['end'])]
+    return [timezone.make_aware(bound) if timezone.is_naive(bound) else bound for bound in bounds]
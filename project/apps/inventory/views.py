@@ -1,20 +1,28 @@
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.generics import ListAPIView
-from rest_framework.decorators import api_view, action
+from rest_framework.decorators import api_view, action, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import filters, status
 from rest_framework.views import APIView
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.http import FileResponse, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django.db import transaction
+from django.db.models import ExpressionWrapper, F, IntegerField, Prefetch, Sum, Window
+from django.db.models.functions import Coalesce
 from django.views import View
-from django.template.loader import get_template
+from django_filters.rest_framework import DjangoFilterBackend
 import datetime
-import io
-import csv
 
+from .caching import add_sold_imeis, available_imeis_key, get_singleton, might_be_sold, retire_sold_imeis
+from .filters import (CashOrderFilter, ClaimFilter, CreditFilter, ProductStockInFilter, ReturnCashOrderFilter,
+                      RoutedSearchFilter)
+from .pagination import CashOrderCursorPagination, CursorPaginationMixin, ProductStockInCursorPagination
 from .serializers import *
-from .utils import html_to_pdf
+from .utils import date_range_params, invoice_pdf, invoices_zip, queryset_in_chunks, stream_csv
 
 
 class IMEIViewSet(ModelViewSet):
@@ -38,18 +46,27 @@ class VendorViewSet(ModelViewSet):
     permission_classes = [IsAuthenticated]
 
 
-class ProductStockInViewSet(ModelViewSet):
+class ProductStockInViewSet(CursorPaginationMixin, ModelViewSet):
     serializer_class = ProductStockInSerializer
-    queryset = ProductStockIn.objects.all().order_by('-created_at')
+    queryset = ProductStockIn.objects.all().order_by('-created_at', '-id')
     permission_classes = [IsAuthenticated]
+    cursor_pagination_class = ProductStockInCursorPagination
 
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [DjangoFilterBackend, RoutedSearchFilter]
+    filterset_class = ProductStockInFilter
     search_fields = ['product__name', 'vendor__name', 'imei_or_serial_number__number', 'id']
+    search_routes = {
+        'imei': ['imei_numbers__number'],
+        'code': ['imei_numbers__number', 'product__name__icontains', 'vendor__name__icontains'],
+        'number': ['id', 'imei_numbers__number'],
+        'text': ['imei_numbers__number', 'product__name__icontains', 'vendor__name__icontains'],
+    }
 
     def get_queryset(self):
+        queryset = ProductStockIn.objects.select_related('product', 'vendor').prefetch_related('imei_or_serial_number')
         if 'available' in self.request.query_params:
-            return ProductStockIn.objects.filter(available_stock__gt=0).order_by('-created_at')
-        return ProductStockIn.objects.all().order_by('-created_at')
+            return queryset.filter(available_stock__gt=0).order_by('-created_at', '-id')
+        return queryset.order_by('-created_at', '-id')
 
     @action(detail=False, methods=['post'])
     def bulk_update(self, request):
@@ -67,18 +84,29 @@ class ProductStockInViewSet(ModelViewSet):
         return Response(serializer.data)
 
     def create(self, request, *args, **kwargs):
-        IMEIs = request.data['imei_or_serial_number']
-        post_IMEIs = []
-        for imei in IMEIs:
-            new_imei, found = IMEINumber.objects.get_or_create(number=imei)
-            post_IMEIs.append(new_imei.number)
-        product = ProductStockIn.objects.create(product=Product.objects.get(id=request.data['product']),
-                                                vendor=Vendor.objects.get(id=request.data['vendor']),
-                                                purchasing_price=request.data['purchasing_price'],
-                                                available_stock=request.data['available_stock'],
-                                                )
-        product.imei_or_serial_number.set(post_IMEIs)
-        return Response(self.serializer_class(product, many=False).data)
+        """ Provides stock-in of one lot, or of a list of lots such as a whole vendor delivery, in one transaction. """
+        entries = request.data if isinstance(request.data, list) else [request.data]
+        products = Product.objects.in_bulk({entry['product'] for entry in entries})
+        vendors = Vendor.objects.in_bulk({entry['vendor'] for entry in entries})
+        if any(int(entry['product']) not in products or int(entry['vendor']) not in vendors for entry in entries):
+            return Response(data="Error found, unknown product or vendor", status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with transaction.atomic():
+                lots = [(ProductStockIn.objects.create(product=products[int(entry['product'])],
+                                                       vendor=vendors[int(entry['vendor'])],
+                                                       purchasing_price=entry['purchasing_price'],
+                                                       available_stock=entry['available_stock'],
+                                                       ), entry['imei_or_serial_number'])
+                        for entry in entries]
+                ProductStockIn.objects.stock_in(lots)
+        except ValidationError as e:
+            return Response(data="Error found, {}".format(e.message), status=status.HTTP_400_BAD_REQUEST)
+
+        stocked = self.get_queryset().filter(id__in=[lot.id for lot, numbers in lots])
+        if not isinstance(request.data, list):
+            return Response(self.serializer_class(stocked.get(), many=False).data)
+        return Response(self.serializer_class(stocked.order_by('id'), many=True).data)
 
     def update(self, request, *args, **kwargs):
         product_id = request.data['id']
@@ -100,44 +128,46 @@ class ProductStockInViewSet(ModelViewSet):
         product.available_stock = request.data['available_stock']
         product.purchasing_price = request.data['purchasing_price']
         product.updated_at = request.data['updated_at']
-        product.imei_or_serial_number.set(post_IMEIs)
-        product.save()
+        try:
+            with transaction.atomic():
+                product.imei_or_serial_number.set(post_IMEIs)
+                product.save()
+        except ValidationError as e:
+            return Response(data="Error found, {}".format(e.message), status=status.HTTP_400_BAD_REQUEST)
         return Response(self.serializer_class(product, many=False).data)
 
 
 class SellerProfileViewSet(ModelViewSet):
     serializer_class = SellerProfileSerializer
-    queryset = SellerProfile.objects.all().order_by('-updated_at')
+    queryset = SellerProfile.objects.with_balance().order_by('-updated_at')
     permission_classes = [IsAuthenticated]
 
     def update(self, request, *args, **kwargs):
-        seller = SellerProfile.objects.get(id=request.data['id'])
-        prev_business_share = seller.business_share
-        new_business_share = request.data['business_share']
-        company = CompanyProfile.objects.get()
-        seller.profit = 0
-        seller.seller_share = request.data['seller_share']
-        seller.business_share = new_business_share
-
         try:
-            transactions = Transaction.objects.filter(seller=seller)
-            for transaction in transactions:
-                cash_order_items = CashOrderItem.objects.filter(cash_order=transaction.order.id)
-                for cash_order_item in cash_order_items:
-                    product_stock = ProductStockIn.objects.get(id=cash_order_item.product_stock.id)
-                    cost_price = product_stock.purchasing_price
-                    sale_price = cash_order_item.price
-                    total_profit = sale_price - cost_price
-                    seller_profit = (total_profit * request.data['seller_share']) / 100
-                    seller.profit += seller_profit
-                    # deducting business profit for previous business share
-                    prev_business_profit = (total_profit * prev_business_share) / 100
-                    company.business_balance -= prev_business_profit
-                    # adding business profit for new business share
-                    new_business_profit = (total_profit * new_business_share) / 100
-                    company.business_balance += new_business_profit
-            company.save()
-            seller.save()
+            with transaction.atomic():
+                seller = SellerProfile.objects.select_for_update().get(id=request.data['id'])
+                prev_business_share = seller.business_share
+                new_business_share = int(request.data['business_share'])
+                seller_share = int(request.data['seller_share'])
+
+                total_profit = CashOrderItem.objects.filter(
+                    cash_order__in=Transaction.objects.filter(seller=seller).values('order')
+                ).aggregate(profit=Coalesce(Sum(ExpressionWrapper(F('price') - F('product_stock__purchasing_price'),
+                                                                  output_field=IntegerField())), 0))['profit']
+
+                # the seller profit is rebased on the new share and the business profit of the previous
+                # business share is replaced with the new one, both as ledger entries
+                BalanceEntry.objects.record("Share update {}".format(seller.username),
+                                            seller=seller,
+                                            seller_profit=int((total_profit * seller_share) / 100)
+                                            - seller.running_profit,
+                                            company=get_singleton(CompanyProfile),
+                                            business_balance=(total_profit * (new_business_share
+                                                                              - prev_business_share)) / 100)
+                seller.seller_share = seller_share
+                seller.business_share = new_business_share
+                seller.save()
+            seller = self.get_queryset().get(id=seller.id)
             return Response(self.serializer_class(seller, many=False).data, status=status.HTTP_200_OK)
         except Exception as e:
             print(e)
@@ -153,19 +183,30 @@ class SettingViewSet(ModelViewSet):
 
 class CashOrderItemViewSet(ModelViewSet):
     serializer_class = CashOrderItemSerializer
-    queryset = CashOrderItem.objects.all().order_by('-created_at')
+    queryset = CashOrderItem.objects.select_related('product_stock__product').order_by('-created_at')
     permission_classes = [IsAuthenticated]
 
 
-class CashOrderViewSet(ModelViewSet):
+class CashOrderViewSet(CursorPaginationMixin, ModelViewSet):
     serializer_class = CashOrderSerializer
-    queryset = CashOrder.objects.all().order_by('-updated_at')
+    queryset = CashOrder.objects.select_related('sale_by').prefetch_related(
+        Prefetch('cashorderitem_set', queryset=CashOrderItem.objects.select_related('product_stock__product'))
+    ).order_by('-updated_at', '-id')
     permission_classes = [IsAuthenticated]
+    cursor_pagination_class = CashOrderCursorPagination
 
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [DjangoFilterBackend, RoutedSearchFilter]
+    filterset_class = CashOrderFilter
     search_fields = [
         'unique_id', 'created_at', 'updated_at', 'sale_by__username'
     ]
+    search_routes = {
+        'imei': ['cashorderitem__imei_or_serial_number'],
+        'code': ['unique_id', 'sale_by__username__icontains'],
+        'number': ['id', 'unique_id'],
+        'date': ['created_at', 'updated_at'],
+        'text': ['sale_by__username__icontains'],
+    }
 
     def create(self, request, *args, **kwargs):
         seller = SellerProfile.objects.get(id=request.data['sale_by'])
@@ -173,38 +214,55 @@ class CashOrderViewSet(ModelViewSet):
         warranty = request.data['warranty']
         items = request.data['items']
 
-        cash_order = CashOrder.objects.create(
-            customer_name=customer_name,
-            sale_by=seller,
-            warranty=warranty,
-        )
-        for item in items:
-            imei_number = IMEINumber.objects.get(number=item['imei_or_serial_number'])
-            CashOrderItem.objects.create(cash_order=cash_order,
-                                         price=item['price'],
-                                         imei_or_serial_number=imei_number,
-                                         product_stock=ProductStockIn.objects.get(id=item['product_stock']))
+        try:
+            imei_numbers = IMEINumber.objects.with_stock_lots([item['imei_or_serial_number'] for item in items])
+        except ValidationError as e:
+            return Response(data="Error found, {}".format(e.message), status=status.HTTP_400_BAD_REQUEST)
 
+        with transaction.atomic():
+            cash_order = CashOrder.objects.create(
+                customer_name=customer_name,
+                sale_by=seller,
+                warranty=warranty,
+            )
+            order_items = CashOrderItem.objects.bulk_create([
+                CashOrderItem(cash_order=cash_order,
+                              price=item['price'],
+                              imei_or_serial_number=imei_numbers[str(item['imei_or_serial_number'])],
+                              product_stock=imei_numbers[str(item['imei_or_serial_number'])].product_stock)
+                for item in items
+            ])
+
+            # bulk_create skips the update_stock signal, so the lots are decremented here
+            ProductStockIn.objects.move_stock_per_lot([item.product_stock_id for item in order_items],
+                                                      available_stock=-1, sold=1)
+            IMEINumber.objects.filter(number__in=imei_numbers).set_status("SOLD")
+            transaction.on_commit(lambda: add_sold_imeis(list(imei_numbers)))
+
+            cash_order.calculate_total_values()
+
+        cash_order = self.get_queryset().get(id=cash_order.id)
         return Response(self.serializer_class(cash_order, many=False).data)
 
+    @transaction.atomic
     def destroy(self, request, *args, **kwargs):
         cash_order = CashOrder.objects.get(id=kwargs['pk'])
-        cash_order_items = CashOrderItem.objects.filter(cash_order=cash_order.id)
         transactions = Transaction.objects.filter(order=cash_order.id)
-        for cash_order_item in cash_order_items:
-            product_stock = ProductStockIn.objects.get(id=cash_order_item.product_stock.id)
-            product_stock.available_stock += 1
-            product_stock.save()
-
-        for transaction in transactions:
-            seller = SellerProfile.objects.get(id=transaction.seller.id)
-            company = CompanyProfile.objects.get(id=transaction.company.id)
-            seller.profit -= transaction.seller_profit
-            seller.save()
-            company.owner_balance -= transaction.owner_profit
-            company.business_balance -= transaction.business_profit
-            company.save()
-            transaction.delete()
+        ProductStockIn.objects.move_stock_per_lot(
+            CashOrderItem.objects.filter(cash_order=cash_order.id).values_list('product_stock', flat=True),
+            available_stock=1,
+        )
+        IMEINumber.objects.filter(cashorderitem__cash_order=cash_order.id).set_status("IN_STOCK")
+        transaction.on_commit(retire_sold_imeis)
+
+        for sale_transaction in transactions:
+            BalanceEntry.objects.record("Order deleted {}".format(cash_order.unique_id),
+                                        seller=sale_transaction.seller,
+                                        seller_profit=-sale_transaction.seller_profit,
+                                        company=sale_transaction.company,
+                                        owner_balance=-sale_transaction.owner_profit,
+                                        business_balance=-sale_transaction.business_profit)
+            sale_transaction.delete()
 
         cash_order.delete()
         return Response(self.serializer_class(cash_order, many=False).data)
@@ -216,57 +274,59 @@ class CashOrderViewSet(ModelViewSet):
 
 class CreditViewSet(ModelViewSet):
     serializer_class = CreditSerializer
-    queryset = Credit.objects.all()
+    queryset = Credit.objects.prefetch_related(
+        Prefetch('credititem_set', queryset=CreditItem.objects.select_related('product_stock__product'))
+    ).order_by('-created_at', '-id')
     permission_classes = [IsAuthenticated]
+    filterset_class = CreditFilter
 
     def create(self, request, *args, **kwargs):
         items = request.data['items']
 
+        try:
+            imei_numbers = IMEINumber.objects.with_stock_lots([item['imei_or_serial_number'] for item in items])
+        except ValidationError as e:
+            return Response(data="Error found, {}".format(e.message), status=status.HTTP_400_BAD_REQUEST)
+
         credit = Credit.objects.create(payment_status=request.data['payment_status'])
         for item in items:
-            imei_number = IMEINumber.objects.get(number=item['imei_or_serial_number'])
-            product_stock = item['product_stock']
+            imei_number = imei_numbers[str(item['imei_or_serial_number'])]
             price = item['price']
 
             CreditItem.objects.create(credit=credit,
                                       price=price,
                                       imei_or_serial_number=imei_number,
-                                      product_stock=ProductStockIn.objects.get(id=product_stock))
+                                      product_stock=imei_number.product_stock)
 
         return Response(self.serializer_class(credit, many=False).data)
 
+    @transaction.atomic
     def update(self, request, *args, **kwargs):
         status = request.data['payment_status']
         credit = Credit.objects.get(id=kwargs['pk'])
         credit.payment_status = status
         credit.save()
-        credit_items = CreditItem.objects.filter(credit=credit)
-
-        for item in credit_items:
-            product_stock = ProductStockIn.objects.get(imei_or_serial_number=item.imei_or_serial_number.number)
+        product_stock_ids = CreditItem.objects.filter(credit=credit).values_list('product_stock', flat=True)
+        imei_numbers = IMEINumber.objects.filter(credititem__credit=credit)
 
-            if status == "PENDING":
-                product_stock.on_credit += 1
-                product_stock.available_stock -= 1
-                product_stock.save()
-            else:
-                product_stock.on_credit -= 1
-                product_stock.sold += 1
-                product_stock.save()
+        if status == "PENDING":
+            ProductStockIn.objects.move_stock_per_lot(product_stock_ids, on_credit=1, available_stock=-1)
+            imei_numbers.set_status("ON_CREDIT")
+        else:
+            ProductStockIn.objects.move_stock_per_lot(product_stock_ids, on_credit=-1, sold=1)
+            imei_numbers.set_status("SOLD")
 
         return Response(self.serializer_class(credit, many=False).data)
 
+    @transaction.atomic
     def destroy(self, request, *args, **kwargs):
         credit = Credit.objects.get(id=kwargs['pk'])
-        credit_items = CreditItem.objects.filter(credit=credit.id)
-        for credit_item in credit_items:
-            product_stock = ProductStockIn.objects.get(id=credit_item.product_stock.id)
-            product_stock.available_stock += 1
-            if credit.payment_status == "PENDING":
-                product_stock.on_credit -= 1
-            else:
-                product_stock.sold -= 1
-            product_stock.save()
+        product_stock_ids = CreditItem.objects.filter(credit=credit.id).values_list('product_stock', flat=True)
+        if credit.payment_status == "PENDING":
+            ProductStockIn.objects.move_stock_per_lot(product_stock_ids, available_stock=1, on_credit=-1)
+        else:
+            ProductStockIn.objects.move_stock_per_lot(product_stock_ids, available_stock=1, sold=-1)
+        IMEINumber.objects.filter(credititem__credit=credit.id).set_status("IN_STOCK")
 
         credit.delete()
         return Response(self.serializer_class(credit, many=False).data)
@@ -274,8 +334,12 @@ class CreditViewSet(ModelViewSet):
 
 class ReturnCashOrderViewSet(ModelViewSet):
     serializer_class = ReturnCashOrderSerializer
-    queryset = ReturnCashOrder.objects.all()
+    queryset = ReturnCashOrder.objects.select_related('cash_order__sale_by').prefetch_related(
+        Prefetch('cash_order__cashorderitem_set',
+                 queryset=CashOrderItem.objects.select_related('product_stock__product'))
+    ).order_by('-created_at', '-id')
     permission_classes = [IsAuthenticated]
+    filterset_class = ReturnCashOrderFilter
 
 
 class ExportCashOrderViews(ListAPIView):
@@ -286,51 +350,48 @@ class ExportCashOrderViews(ListAPIView):
     queryset = CashOrder.objects.all()
     search_fields = ['unique_id']
 
-    def get_queryset(self):
-        try:
-            start_date = self.request.query_params['start']
-            end_date = self.request.query_params['end']
-            cash_orders = CashOrder.objects.filter(updated_at__range=[start_date, end_date])
-            return cash_orders
-        except Exception as e:
-            print(e)
-            return {}
-
-    def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
+    header = [field.name for field in CashOrder._meta.concrete_fields if field.name != "created_at"]
+    item_header = ["item_" + field.name for field in CashOrderItem._meta.concrete_fields if field.name != "created_at"]
 
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="report.csv"'
-        writer = csv.writer(response)
+    def get_queryset(self):
+        date_range = date_range_params(self.request.query_params, CashOrder._meta.get_field('updated_at'))
+        if date_range is None:
+            return CashOrder.objects.none()
+        return CashOrder.objects.filter(updated_at__range=date_range).select_related('sale_by').prefetch_related(
+            Prefetch('cashorderitem_set',
+                     queryset=CashOrderItem.objects.select_related('imei_or_serial_number', 'product_stock__product'))
+        )
 
+    def get_rows(self, queryset):
         total_business = 0
         total_profit = 0
 
-        for order in queryset:
-            # cash order basic header
-            excluded = ["cashorderitem", "returncashorder", "transaction", "created_at"]
-            header = [field.name for field in order._meta.get_fields() if field.name not in excluded]
-            writer.writerow(header)
-            # writing order basic details
-            writer.writerow([getattr(order, field) for field in header])
+        for order in queryset_in_chunks(queryset):
+            # cash order basic header and details
+            yield self.header
+            yield [getattr(order, field) for field in self.header]
 
-            total_profit += order.total_profit
-            total_business += order.total_amount
+            total_profit += order.total_profit or 0
+            total_business += order.total_amount or 0
 
-            # cash order item header
-            item_header = ["item_" + field.name for field in CashOrderItem.objects.first()._meta.get_fields() if field.name != "created_at"]
-            writer.writerow(item_header)
-            # writing order items data
-            for order_item in CashOrderItem.objects.filter(cash_order=order):
-                writer.writerow([getattr(order_item, field.replace("item_", "")) for field in item_header])
-            writer.writerow([])
+            # cash order items header and data
+            yield self.item_header
+            for order_item in order.cashorderitem_set.all():
+                yield [getattr(order_item, field.replace("item_", "")) for field in self.item_header]
+            yield []
 
-        writer.writerow([])
-        writer.writerow([])
+        yield []
+        yield []
 
-        writer.writerow(["Total Business", "Total Profit"])
-        writer.writerow([total_business, total_profit])
-        return response
+        yield ["Total Business", "Total Profit"]
+        yield [total_business, total_profit]
+
+    def list(self, request, *args, **kwargs):
+        try:
+            queryset = self.get_queryset()
+        except ValidationError as e:
+            return Response(data="Error found, {}".format(" ".join(e.messages)), status=status.HTTP_400_BAD_REQUEST)
+        return stream_csv(self.get_rows(queryset), "report.csv")
 
 
 class ExportReturnCashOrderViews(ListAPIView):
@@ -341,63 +402,76 @@ class ExportReturnCashOrderViews(ListAPIView):
     queryset = ReturnCashOrder.objects.all()
     search_fields = ['cash_order__unique_id']
 
-    def get_queryset(self):
-        try:
-            start_date = self.request.query_params['start']
-            end_date = self.request.query_params['end']
-            return ReturnCashOrder.objects.filter(created_at__range=[start_date, end_date])
-        except Exception as e:
-            print(e)
-            return {}
+    return_header = [field.name for field in ReturnCashOrder._meta.concrete_fields if field.name != "created_at"]
+    cash_header = ["order_" + field.name for field in CashOrder._meta.concrete_fields
+                   if field.name not in ["id", "unique_id", "created_at", "total_profit"]]
 
-    def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="report.csv"'
-        writer = csv.writer(response)
+    def get_queryset(self):
+        date_range = date_range_params(self.request.query_params, ReturnCashOrder._meta.get_field('created_at'))
+        if date_range is None:
+            return ReturnCashOrder.objects.none()
+        return ReturnCashOrder.objects.filter(created_at__range=date_range).select_related('cash_order__sale_by')
 
+    def get_rows(self, queryset):
         total_returned_amount = 0
 
-        for return_order in queryset:
-            excluded = ["cashorderitem", "returncashorder", "transaction", "created_at"]
-            # Return order header
-            return_header = [field.name for field in return_order._meta.get_fields() if field.name not in excluded]
-            cashorder_excluded = ["cashorderitem", "returncashorder", "transaction",
-                                  'id', "unique_id", "created_at", "total_profit"]
-            cash_header = list()
-            cash_order = CashOrder.objects.get(unique_id=return_order.cash_order)
-            for cashorder_field in cash_order._meta.get_fields():
-                if cashorder_field.name not in cashorder_excluded:
-                    cash_header.append("order_" + cashorder_field.name)
-            writer.writerow(return_header + cash_header)
-            total_returned_amount += return_order.return_amount
+        for return_order in queryset_in_chunks(queryset):
+            yield self.return_header + self.cash_header
+            total_returned_amount += return_order.return_amount or 0
             # writing order basic details
-            return_data = [getattr(return_order, field) for field in return_header]
-            cash_data = [getattr(cash_order, field.replace("order_", "")) for field in cash_header]
-            writer.writerow(return_data + cash_data)
-            writer.writerow([])
+            return_data = [getattr(return_order, field) for field in self.return_header]
+            cash_data = [getattr(return_order.cash_order, field.replace("order_", "")) for field in self.cash_header]
+            yield return_data + cash_data
+            yield []
 
-        writer.writerow([])
-        writer.writerow([])
+        yield []
+        yield []
 
-        writer.writerow(["Total Amount Returned"])
-        writer.writerow([total_returned_amount])
-        return response
+        yield ["Total Amount Returned"]
+        yield [total_returned_amount]
+
+    def list(self, request, *args, **kwargs):
+        try:
+            queryset = self.get_queryset()
+        except ValidationError as e:
+            return Response(data="Error found, {}".format(" ".join(e.messages)), status=status.HTTP_400_BAD_REQUEST)
+        return stream_csv(self.get_rows(queryset), "report.csv")
 
 
 class GenerateOrderInvoice(View):
     def get(self, request, unique_id):
-        cash_order = CashOrder.objects.get(unique_id=unique_id)
-        cash_order_items = CashOrderItem.objects.filter(cash_order=cash_order.id)
+        cash_order = CashOrder.objects.select_related('sale_by').prefetch_related(
+            Prefetch('cashorderitem_set', queryset=CashOrderItem.objects.select_related('product_stock__product'))
+        ).get(unique_id=unique_id)
+        pdf = invoice_pdf(cash_order)
+        return HttpResponse(pdf, content_type="application/pdf")
 
-        html = get_template("inventory/company_invoice.html")
-        context = {'cash_order': cash_order, 'cash_order_items': cash_order_items}
-        html_content = html.render(context)
-        with open("project/templates/inventory/temp.html", "w") as file:
-            file.write(html_content)
 
-        pdf = html_to_pdf("inventory/temp.html")
-        return HttpResponse(pdf, content_type="application/pdf")
+class ExportOrderInvoices(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        unique_ids = request.query_params.getlist('unique_id')
+        try:
+            date_range = date_range_params(request.query_params, CashOrder._meta.get_field('updated_at'))
+        except ValidationError as e:
+            return Response(data="Error found, {}".format(" ".join(e.messages)), status=status.HTTP_400_BAD_REQUEST)
+        if unique_ids:
+            cash_orders = CashOrder.objects.filter(unique_id__in=unique_ids)
+        elif date_range is not None:
+            cash_orders = CashOrder.objects.filter(updated_at__range=date_range)
+        else:
+            return Response(data="Provide unique_id values or a start and end date",
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        cash_orders = cash_orders.select_related('sale_by').prefetch_related(
+            Prefetch('cashorderitem_set', queryset=CashOrderItem.objects.select_related('product_stock__product'))
+        )
+        archive, failed = invoices_zip(cash_orders)
+        response = FileResponse(archive, as_attachment=True, filename='invoices.zip')
+        if failed:
+            response['X-Failed-Invoices'] = ",".join(failed)
+        return response
 
 
 class CompanyProfileViewSet(ModelViewSet):
@@ -410,9 +484,12 @@ class CompanyProfileViewSet(ModelViewSet):
 
 class ClaimViewSet(ModelViewSet):
     serializer_class = ClaimSerializer
-    queryset = Claim.objects.all()
+    queryset = Claim.objects.select_related('product_stock__product', 'product_stock__vendor') \
+        .order_by('-created_at', '-id')
     permission_classes = [IsAuthenticated]
+    filterset_class = ClaimFilter
 
+    @transaction.atomic
     def update(self, request, *args, **kwargs):
         status = request.data['status']
         product_stock = request.data['product_stock']
@@ -423,25 +500,21 @@ class ClaimViewSet(ModelViewSet):
         claim.product_stock = ProductStockIn.objects.get(id=product_stock)
         claim.reason = reason
         claim.imei_or_serial_number = IMEINumber.objects.get(number=imei_or_serial_number)
+        # Claim.save moves the stock when the status changes
         claim.save()
-
-        if status == "CLEARED":
-            product_stock = ProductStockIn.objects.get(imei_or_serial_number=claim.imei_or_serial_number)
-            product_stock.available_stock += 1
-            product_stock.on_claim -= 1
-            product_stock.save()
         return Response(self.serializer_class(claim, many=False).data)
 
+    @transaction.atomic
     def destroy(self, request, *args, **kwargs):
         claim = Claim.objects.get(id=kwargs['pk'])
-        product_stock = ProductStockIn.objects.get(id=claim.product_stock.id)
+        product_stock = ProductStockIn.objects.filter(id=claim.product_stock_id)
+        imei_number = IMEINumber.objects.filter(number=claim.imei_or_serial_number_id)
         if claim.status == "PENDING":
-            product_stock.on_claim -= 1
-            product_stock.available_stock += 1
+            product_stock.move_stock(on_claim=-1, available_stock=1)
+            imei_number.set_status("IN_STOCK")
         else:
-            product_stock.on_claim += 1
-            product_stock.available_stock -= 1
-        product_stock.save()
+            product_stock.move_stock(on_claim=1, available_stock=-1)
+            imei_number.set_status("ON_CLAIM")
         claim.delete()
         return Response(self.serializer_class(claim, many=False).data)
 
@@ -450,17 +523,15 @@ class AvailableImeiViews(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        data = {
-            'available_imeis': []
-        }
         try:
-            product_id = request.query_params['product']
-            product = Product.objects.get(id=product_id)
-            product_stocks = ProductStockIn.objects.filter(available_stock__gt=0, product=product.id)
-            for product_stock in product_stocks:
-                for imei in product_stock.imei_or_serial_number.all():
-                    data['available_imeis'].append(imei.number)
-            return Response(data=data, status=status.HTTP_200_OK)
+            product_id = int(request.query_params['product'])
+            key = available_imeis_key(product_id)
+            available_imeis = cache.get(key)
+            if available_imeis is None:
+                product = Product.objects.get(id=product_id)
+                available_imeis = list(IMEINumber.objects.available(product.id))
+                cache.set(key, available_imeis)
+            return Response(data={'available_imeis': available_imeis}, status=status.HTTP_200_OK)
         except Exception as e:
             print(e)
             return Response(data={"Error, {}".format(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -469,89 +540,94 @@ class AvailableImeiViews(APIView):
 @api_view(['POST'])
 def check_valid_imei(request):
     imei = request.data['imei_or_serial_number']
-    if CashOrderItem.objects.filter(imei_or_serial_number=imei).exists():
+    if might_be_sold(imei) and CashOrderItem.objects.filter(imei_or_serial_number=imei).exists():
         return Response(data="False", status=status.HTTP_200_OK)
     else:
         return Response(data="True", status=status.HTTP_200_OK)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def check_valid_imeis(request):
+    if hasattr(request.data, 'getlist'):
+        imeis = request.data.getlist('imei_or_serial_numbers')
+    else:
+        imeis = request.data.get('imei_or_serial_numbers')
+    if not isinstance(imeis, list) or not imeis:
+        return Response(data="Error found, imei_or_serial_numbers must be a non-empty list",
+                        status=status.HTTP_400_BAD_REQUEST)
+    imeis = [str(imei) for imei in imeis]
+    return Response(data=IMEINumber.objects.statuses(imeis), status=status.HTTP_200_OK)
+
+
 class ExportWeekClosureView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def get(self, request):
-        sellers = SellerProfile.objects.all()
-        company = CompanyProfile.objects.get()
-
-        content = io.BytesIO()
-        row = "{username}, {profit}, {seller_share}, {business_share}, {updated_at}, {created_at}\n"
-        content.write(
-            row.format(
-                username="Name",
-                profit="Profit",
-                seller_share="Seller share",
-                business_share="Business Share",
-                updated_at="Updated Date",
-                created_at="Joining Date",
-            ).encode("utf-8")
-        )
-
-        total_profit = 0
+    header = ["Name", "Profit", "Seller share", "Business Share", "Updated Date", "Joining Date"]
 
-        for seller in sellers:
-            total_profit += seller.profit
-
-            content.write(
-                row.format(
-                    username=seller.username,
-                    profit=seller.profit,
-                    seller_share=seller.seller_share,
-                    business_share=seller.business_share,
-                    updated_at=seller.updated_at.strftime("%d-%m-%Y %H:%M:%S"),
-                    created_at=seller.created_at.strftime("%d-%m-%Y %H:%M:%S"),
-                ).encode("utf-8")
+    def get(self, request):
+        if 'closure' in request.query_params:
+            if not request.query_params['closure'].isdigit():
+                return Response(data="Error found, closure must be a week closure id",
+                                status=status.HTTP_400_BAD_REQUEST)
+            week_closure = get_object_or_404(WeekClosure, id=request.query_params['closure'])
+            sellers = week_closure.sellers.order_by('seller').values_list(
+                'seller__username', 'profit', 'seller_share', 'business_share', 'created_at', 'seller__created_at',
+                Window(Sum('profit')),
             )
+            business_profit = week_closure.business_profit
+            date = week_closure.created_at.date()
+        else:
+            balance = F('profit') + F('pending_profit') - F('closed_profit')
+            sellers = SellerProfile.objects.with_balance().order_by('id').values_list(
+                'username', balance, 'seller_share', 'business_share', 'updated_at', 'created_at',
+                Window(Sum(balance)),
+            )
+            business_profit = CompanyProfile.objects.get().current_business_balance
+            date = datetime.date.today()
 
-        total_row = "\n{total_profit}, {business_profit}"
-        content.write(
-            total_row.format(
-                total_profit="Total Profit",
-                business_profit="Business Profit",
-            ).encode("utf-8")
-        )
-        content.write(
-            total_row.format(
-                total_profit=f"PKR {total_profit}",
-                business_profit=f"PKR {company.business_balance}",
-            ).encode("utf-8")
-        )
+        return stream_csv(self.get_rows(sellers, business_profit), f'Week Closure {date}.csv')
 
-        content.seek(0)
+    def get_rows(self, sellers, business_profit):
+        yield self.header
 
-        return FileResponse(
-            content, as_attachment=True, filename=f'Week Closure {datetime.date.today()}.csv'
-        )
+        total_profit = 0
+        for username, profit, seller_share, business_share, updated_at, created_at, total_profit in sellers:
+            yield [username, profit, seller_share, business_share,
+                   updated_at.strftime("%d-%m-%Y %H:%M:%S"), created_at.strftime("%d-%m-%Y %H:%M:%S")]
+
+        yield []
+        yield ["Total Profit", "Business Profit"]
+        yield [f"PKR {total_profit}", f"PKR {business_profit}"]
 
 
 class WeekClosureViews(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        return Response(data=WeekClosureSerializer(WeekClosure.objects.all(), many=True).data,
+        week_closures = WeekClosure.objects.prefetch_related('sellers__seller')
+        return Response(data=WeekClosureSerializer(week_closures, many=True).data,
                         status=status.HTTP_200_OK)
 
     def post(self, request):
-        sellers = SellerProfile.objects.all()
-        total_profit = 0
-
-        for seller in sellers:
-            total_profit += seller.profit
-            seller.profit = 0
-            seller.save()
-
-        company = CompanyProfile.objects.get()
-
-        WeekClosure.objects.create(total_profit=total_profit,
-                                   business_profit=company.business_balance)
-        company.business_balance = 0
-        company.save()
+        with transaction.atomic():
+            # balances are not reset: the closure records where each running total stood, and
+            # current balances are counted from there. Compacting locks the company row, which
+            # serializes closures.
+            BalanceEntry.objects.compact()
+            company = CompanyProfile.objects.get()
+            sellers = list(SellerProfile.objects.with_balance())
+
+            week_closure = WeekClosure.objects.create(total_profit=sum(seller.balance for seller in sellers),
+                                                      business_profit=company.current_business_balance,
+                                                      closing_business_balance=company.running_business_balance)
+            SellerClosure.objects.bulk_create([
+                SellerClosure(week_closure=week_closure,
+                              seller=seller,
+                              profit=seller.balance,
+                              closing_profit=seller.running_profit,
+                              business_share=seller.business_share,
+                              seller_share=seller.seller_share)
+                for seller in sellers
+            ])
         return Response(data="Data has been reset", status=status.HTTP_205_RESET_CONTENT)